@@ -3,21 +3,31 @@ API Endpoints
 ...
 """
 from fastapi import FastAPI, Request, Depends
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr
 from typing import Optional
-from services import chatbot, metadata_extraction
+from services import chatbot, achatbot, metadata_extraction, metadata_cache, start_warm_up
 import base64
+import hmac
 from urllib.parse import unquote
 import os
-from services.common.utils import session_client, message_client, logger
+from services.common.utils import session_client, message_client, logger, session_list_cache
 from datetime import datetime
 from fastapi.responses import JSONResponse
 from zoneinfo import ZoneInfo
 from fastapi.encoders import jsonable_encoder
 from config import settings
 from services.common.authDependency import Authorization, DatasourceAuthorization
+from services.common.databricks_pool import databricks_pool
+from services.common.search_clients import search_client_registry
+from services.common.persistence import chat_persistence_queue
+from app_logger import bind_log_context, shutdown_logging, logging_stats
+from services.common.metrics import component_stats, instrument_stream, ainstrument_stream, render_metrics
+from services.common.answer_cache import answer_cache
+from services.common.query_cache import query_cache
+from services.common.json_repair import json_repairer
 
 """Initializing the FastAPI application"""
 app = FastAPI(dependencies=[Depends(Authorization)])
@@ -67,12 +77,58 @@ def health_check():
     """
     return successResponse("Application is running successfully !")
 
+def metrics(request: Request):
+    """
+    Prometheus scrape endpoint: chat latency, tokens and cost, Databricks, AI Search and Cosmos latency, pool and cache stats.
+    Served outside the app-wide Entra dependency, requires the METRICS_SCRAPE_TOKEN bearer token.
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if (
+        not settings.metrics_scrape_token
+        or scheme.lower() != "bearer"
+        or not hmac.compare_digest(token.encode(), settings.metrics_scrape_token.encode())
+    ):
+        return Response(status_code=401, content="Invalid scrape token")
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
+# Plain Starlette route: app level dependencies (Authorization) only apply to FastAPI routes.
+# Fails closed, without a scrape token the route is not served (404)
+if settings.metrics_scrape_token:
+    app.add_route("/metrics", metrics, methods=["GET"])
+else:
+    logger.warning("METRICS_SCRAPE_TOKEN is not set, /metrics is disabled")
+
+# Stats of process-wide pools, caches and queues exported as gauges on every scrape
+component_stats.register("databricks_pool", databricks_pool.stats)
+component_stats.register("answer_cache", answer_cache.stats)
+component_stats.register("query_cache", query_cache.stats)
+component_stats.register("chat_persistence_queue", chat_persistence_queue.stats)
+component_stats.register("json_repair", json_repairer.stats)
+component_stats.register("logging", logging_stats)
+
+@app.on_event("startup")
+def startup_event():
+    """Warm the agent pipeline and metadata snapshots, start their background refresh."""
+    start_warm_up()
+    metadata_cache.start(warm=settings.metadata_warm_on_startup)
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """Flush pending chat writes and release pooled connections when the worker stops."""
+    if not chat_persistence_queue.flush(timeout=settings.persistence_flush_timeout):
+        logger.error("Timed out flushing pending chat writes on shutdown")
+    metadata_cache.stop()
+    databricks_pool.close_all()
+    search_client_registry.close()
+    shutdown_logging()
+
 def verify_datasource(datasource):
     if datasource.lower() in allowed_datasources:
         return 'Verified'
 
 @app.post("/api/agent/v1")
-def chatAgent(request: Chatagent, request_: Request):
+async def chatAgent(request: Chatagent, request_: Request):
     """
     Handles chat requests for the agent.
     Receives user input and returns the agent's response.
@@ -88,22 +144,23 @@ def chatAgent(request: Chatagent, request_: Request):
 
     except Exception as e:
         log_str = f"Error occurred while generating response for sessionId {session_id}: {str(e)}"
-        print(log_str)
         logger.error(log_str)
         return errorResponse("An internal error has occurred. Please try again later.")
 
+    # Request fields attached to every log record of this chat, including tools running on worker threads
+    bind_log_context(sessionId=session_id, datasource=datasource, userId=userId)
     log_str=f"Request received to AI Assistant. SessionId {session_id}"
-    print(log_str)
     logger.info(log_str)
     response = verify_datasource(datasource)
     if response is None:
         return errorResponse(f"Invalid datasource: {datasource}")
-    datasource_details, datasources_backend = DatasourceAuthorization(request_.headers.get("authorization"),request_.headers.get('Isresearch'))
+    datasource_details, datasources_backend = await run_in_threadpool(DatasourceAuthorization,request_.headers.get("authorization"),request_.headers.get('Isresearch'))
     if datasource.lower() not in datasources_backend:
         return errorResponse(f"You do not have access to the datasource: {datasource}")
     
     try:
-        db_status,status_code = session_client.insertRecord(
+        db_status,status_code = await run_in_threadpool(
+            session_client.insertRecord,
             {
                 "id":userId+'-'+session_id,
                 "userId" :userId,
@@ -117,11 +174,12 @@ def chatAgent(request: Chatagent, request_: Request):
                 "isDeleted": 'False'
             }
         )
-        print(db_status,status_code)
-        return StreamingResponse(chatbot(session_id, input_text, datasource, userId), media_type="text/event-stream")
+        logger.info("Session insert status %s %s", db_status, status_code)
+        if settings.async_pipeline_enabled:
+            return StreamingResponse(ainstrument_stream(await achatbot(session_id, input_text, datasource, userId), datasource), media_type="text/event-stream")
+        return StreamingResponse(instrument_stream(chatbot(session_id, input_text, datasource, userId), datasource), media_type="text/event-stream")
     except Exception as e:
         log_str = f"Error occurred while generating response for sessionId {session_id}: {str(e)}"
-        print(log_str)
         logger.error(log_str)
         return errorResponse("An internal error has occurred. Please try again later.")
 
@@ -135,28 +193,42 @@ def listsessions(request:Request,userEmail:EmailStr):
     try:
         isresearch_user = request.headers.get('Isresearch','false')
         ...
-        # Fetching last 10 interactions per each datasource
+        # Fetching last 10 interactions per each datasource (SESSIONS_PER_DATASOURCE)
         ...
-        distinct_datasource_query = f"SELECT DISTINCT c.dataSource from c where c.userId='{userEmail}'"
-        distinct_datasources = session_client.fetchRecord(distinct_datasource_query)['response']
+        cached_sessions = session_list_cache.get(userEmail, isresearch_user)
+        if cached_sessions is not None:
+            return successResponse({"userId":userEmail,"sessions":cached_sessions})
+
+        # Single query scoped to the user's partition, newest first.
+        # Expects a composite index on (userId ASC, lastUpdatedAt DESC) on chatSessions.
+        query = (
+            "SELECT TOP @limit c.sessionId,c.sessionName,c.lastUpdatedAt,c.dataSource from c "
+            "where c.userId=@userId ORDER BY c.lastUpdatedAt DESC"
+        )
+        parameters = [
+            {"name":"@userId","value":userEmail},
+            {"name":"@limit","value":settings.session_list_scan_limit}
+        ]
+        session_data = session_client.fetchRecord(query,[userEmail],parameters=parameters)['response']
         sessions=[]
-        for datasource in distinct_datasources:
-            if datasource['dataSource'].lower() not in allowed_datasources:
+        sessions_per_datasource={}
+        for session in session_data:
+            datasource = str(session.get('dataSource','')).lower()
+            if datasource not in allowed_datasources:
+                continue
+            if isresearch_user=='true' and datasource!='research':
                 continue
-            if isresearch_user=='true' and datasource['dataSource'].lower()!='research':
+            elif isresearch_user=='false' and datasource=='research':
                 continue
-            elif isresearch_user=='false' and datasource['dataSource'].lower()=='research':
+            if sessions_per_datasource.get(datasource,0) >= settings.sessions_per_datasource:
                 continue
-            
-            query = f"SELECT c.sessionId,c.sessionName,c.lastUpdatedAt,c.dataSource from c where c.userId='{userEmail}' and c.dataSource='{datasource['dataSource']}' OFFSET 0 LIMIT 10"
-            session_data = session_client.fetchRecord(query)['response']
-            if session_data:
-                sessions.extend(session_data)
+            sessions_per_datasource[datasource] = sessions_per_datasource.get(datasource,0)+1
+            sessions.append(session)
+        session_list_cache.put(userEmail, isresearch_user, sessions)
         
         return successResponse({"userId":userEmail,"sessions":sessions})
     except Exception as e:
         log_str = f"Error occurred while fetching sessions userEmail {userEmail} error: {str(e)}"
-        print(log_str)
         logger.error(log_str)
         return errorResponse("An internal error has occurred. Please try again later.")
 
@@ -172,10 +244,14 @@ def sessionhistory(sessionId: str,userEmail:EmailStr):
         query = f"select * from c"
         
         session_data = message_client.fetchRecord(query,[userEmail,sessionId])
-        return successResponse({"sessionId":sessionId,"messages":session_data['response']})
+        # Messages of this process still in the write-behind queue replace their stored version
+        messages = {message['id']:message for message in session_data['response']}
+        for message in chat_persistence_queue.pending((userEmail,sessionId)):
+            messages[message['id']] = message
+        messages = sorted(messages.values(),key=lambda message: message.get('chatId',0))
+        return successResponse({"sessionId":sessionId,"messages":messages})
     except Exception as e:
         log_str = f"Error occurred while fetching chatHistory sessionId {sessionId} error: {str(e)}"
-        print(log_str)
         logger.error(log_str)
         return errorResponse("An internal error has occurred. Please try again later.")
 
@@ -194,7 +270,6 @@ def datasource_metainfo(datasource: str):
         return successResponse(jsonable_encoder(metadata_details))
     except Exception as e:
         log_str = f"Error occured while fetching metatda datasource {datasource} error: {str(e)}"
-        print(log_str)
         logger.error(log_str)
         return errorResponse("An internal error has occurred. Please try again later.")
 
@@ -214,10 +289,14 @@ def update_chat_flags(data: UpdateFlagsRequest):
     Updates flags for a chat record such as showSql and showVisualization.
     ...
     """
-    payload = message_client.fetchRecord(f"select * from c where c.chatId={data.chatId}",[data.userEmail,data.sessionId])['response'][0]
     if data.showSql:
-        payload['showSql']=True
+        operations=[{"op":"set","path":"/showSql","value":True}]
     elif data.showVisualization:
-        payload['showVisualization']=True
-    response = message_client.updateRecord(data.sessionId+'-'+str(data.chatId),payload)
+        operations=[{"op":"set","path":"/showVisualization","value":True}]
+    else:
+        return {"status": "No flags to update"}
+    # The message may still be queued, patching first would 404 or be overwritten by the delayed upsert
+    if not chat_persistence_queue.flush(timeout=settings.persistence_session_flush_timeout,group=(data.userEmail,data.sessionId)):
+        logger.error("Timed out flushing pending chat writes of session %s before the flag update", data.sessionId)
+    response = message_client.patchRecord(data.sessionId+'-'+str(data.chatId),[data.userEmail,data.sessionId],operations)
     return response
\ No newline at end of file
@@ -1,8 +1,12 @@
 import warnings
 warnings.filterwarnings("ignore")
 import uvicorn
+from app_logger import setup_logging
+setup_logging()
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from api.routes.endpoints import app
+from services.common.tracing import configure_tracing
+from config import settings
 import os
 
 """
@@ -18,8 +22,9 @@ def start_app():
         port=8000
     )
 
+configure_tracing()
 instrumentation_key = os.getenv("APPLICATION_INSIGHTS_INSTRUMENTATION_KEY")
-if instrumentation_key:
+if instrumentation_key or settings.tracing_exporter.lower() != "none":
     FastAPIInstrumentor.instrument_app(app)
 
 if __name__ == "__main__":
@@ -0,0 +1,161 @@
+"""
+Structured application logging: JSON records written by a background listener thread
+"""
+
+from logging.handlers import QueueHandler, QueueListener
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from config import settings
+import logging
+import random
+import copy
+import queue
+import json
+import sys
+
+APP_LOGGER_NAME = "AI DataExplorer"
+CONTEXT_FIELDS = ("sessionId", "datasource", "chatId", "userId")
+
+# Request context for code that has no Main instance at hand (tools, endpoints)
+log_context = ContextVar("log_context", default={})
+
+def bind_log_context(**fields):
+    """Binds request fields to every record logged in the current context, returns a token for reset_log_context."""
+    return log_context.set({**log_context.get(), **{key: value for key, value in fields.items() if value is not None}})
+
+def reset_log_context(token):
+    log_context.reset(token)
+
+def truncate(text, max_chars):
+    text = str(text)
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]} ...[truncated {len(text) - max_chars} chars]"
+
+class RequestLogger(logging.LoggerAdapter):
+    """
+    Logger bound to one chat request, the request fields are attached to every record.
+    payload() logs verbose bodies (prompts, histories, responses) subject to sampling and size caps.
+    """
+    def process(self, msg, kwargs):
+        kwargs["extra"] = {**kwargs.get("extra", {}), "context": self.extra}
+        return msg, kwargs
+
+    def bind(self, **fields):
+        self.extra.update({key: value for key, value in fields.items() if value is not None})
+
+    def payload(self, label, value, level=logging.INFO):
+        self.log(level, "%s %s", label, truncate(value, settings.log_payload_max_chars), extra={"payload": True})
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        context = {**log_context.get(), **getattr(record, "context", {})}
+        for field in CONTEXT_FIELDS:
+            if field in context and not hasattr(record, field):
+                setattr(record, field, context[field])
+        return True
+
+class PayloadSamplingFilter(logging.Filter):
+    """Keeps a sample of payload records, other records always pass."""
+    def __init__(self, sample_rate):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        if not getattr(record, "payload", False):
+            return True
+        return random.random() < self.sample_rate
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, max_message_chars):
+        super().__init__()
+        self.max_message_chars = max_message_chars
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": truncate(record.getMessage(), self.max_message_chars),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        exception = getattr(record, "exception", None) or (self.formatException(record.exc_info) if record.exc_info else None)
+        if exception:
+            entry["exception"] = exception
+        return json.dumps(entry, default=str)
+
+class DroppingQueueHandler(QueueHandler):
+    """Never blocks the request thread: records are dropped (and counted) when the queue is full."""
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.setFormatter(logging.Formatter())
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Render message and traceback on the caller, the listener only serializes plain fields
+        record = copy.copy(record)
+        record.exception = self.formatter.formatException(record.exc_info) if record.exc_info else None
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class DrainingQueueListener(QueueListener):
+    def enqueue_sentinel(self):
+        # Waits for room so the stop marker is never dropped on a full queue
+        self.queue.put(self._sentinel)
+
+_listener = None
+_queue_handler = None
+
+def setup_logging():
+    """
+    Routes the application logger through a bounded queue to a listener thread writing JSON lines
+    to stdout (and LOG_FILE when set). Safe to call more than once.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return _listener
+    formatter = JsonFormatter(settings.log_max_message_chars)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if settings.log_file:
+        handlers.append(logging.FileHandler(settings.log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(settings.log_queue_size))
+    _queue_handler.addFilter(ContextFilter())
+    _queue_handler.addFilter(PayloadSamplingFilter(settings.log_payload_sample_rate))
+
+    app_logger = logging.getLogger(APP_LOGGER_NAME)
+    app_logger.setLevel(settings.log_level)
+    app_logger.handlers = [_queue_handler]
+    app_logger.propagate = False
+
+    _listener = DrainingQueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+def shutdown_logging():
+    """Drains queued records and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def logging_stats():
+    return {"dropped": _queue_handler.dropped if _queue_handler else 0, "queued": _queue_handler.queue.qsize() if _queue_handler else 0}
+
+def get_request_logger(**fields):
+    return RequestLogger(logging.getLogger(APP_LOGGER_NAME), {key: value for key, value in fields.items() if value is not None})
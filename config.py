@@ -10,11 +10,17 @@ class Settings:
     def __init__(self):
         # env-based settings
         self.LLM_Config = ast.literal_eval(os.getenv('LLM_Config', '{}'))
+        self.llm_max_connections = int(os.getenv('LLM_MAX_CONNECTIONS', '100'))
+        self.llm_max_keepalive_connections = int(os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS', '20'))
         self.search_key = os.getenv('AI_SEARCH_API_KEY')
         self.search_endpoint = os.getenv('AI_SEARCH_ENDPOINT')
         self.research_search_index = os.getenv('RESEARCH_AI_INDEX')
         self.research_search_section_index = os.getenv('RESEARCH_AI_SECTION_INDEX')
         
+        self.search_pool_connections = int(os.getenv('AI_SEARCH_POOL_CONNECTIONS', '10'))
+        self.search_pool_maxsize = int(os.getenv('AI_SEARCH_POOL_MAXSIZE', '20'))
+        self.research_section_workers = int(os.getenv('RESEARCH_SECTION_WORKERS', '5'))
+        
         self.semantic_search_index = os.getenv('SEMANTIC_AI_SEARCH_INDEX', 'source-catalog-ai-data-explorer')
         self.sohea_search_index = os.getenv('SOHEA_INDEX', 'sohea-catalog-ai-data-explorer')
         self.medical_code_index = os.getenv('MEDICAL_CODE_INDEX', 'medical-code-ai-data-explorer')
@@ -26,6 +32,118 @@ class Settings:
         self.storage_dbsecretkey = os.getenv('COSMOS_DB_KEY')
         self.storage_dbname = os.getenv('COSMOS_DB_NAME', 'backend-ai-data-explorer')
         self.db_schema = os.getenv('DATABRICKS_CATALOG_NAME')
+        self.persistence_max_retries = int(os.getenv('PERSISTENCE_MAX_RETRIES', '3'))
+        self.persistence_retry_backoff = float(os.getenv('PERSISTENCE_RETRY_BACKOFF_SECONDS', '0.5'))
+        self.persistence_flush_timeout = float(os.getenv('PERSISTENCE_FLUSH_TIMEOUT_SECONDS', '20'))
+        # Write-behind workers, writes of one chat session stay in order on a single worker at a time
+        self.persistence_workers = int(os.getenv('PERSISTENCE_WORKERS', '8'))
+        # Attempts to claim the next chatId with a conditional create when another turn took it first
+        self.chat_id_claim_attempts = int(os.getenv('CHAT_ID_CLAIM_ATTEMPTS', '5'))
+        # Wait for a session's pending chat writes before a flag patch
+        self.persistence_session_flush_timeout = float(os.getenv('PERSISTENCE_SESSION_FLUSH_TIMEOUT_SECONDS', '5'))
+        self.session_list_cache_ttl = float(os.getenv('SESSION_LIST_CACHE_TTL_SECONDS', '30'))
+        self.session_list_scan_limit = int(os.getenv('SESSION_LIST_SCAN_LIMIT', '500'))
+        self.sessions_per_datasource = int(os.getenv('SESSIONS_PER_DATASOURCE', '10'))
+        
+        # Databricks connection pool settings
+        self.db_pool_size = int(os.getenv('DATABRICKS_POOL_SIZE', '8'))
+        self.db_pool_timeout = float(os.getenv('DATABRICKS_POOL_TIMEOUT_SECONDS', '30'))
+        self.db_pool_idle_timeout = float(os.getenv('DATABRICKS_POOL_IDLE_TIMEOUT_SECONDS', '300'))
+        self.db_pool_max_lifetime = float(os.getenv('DATABRICKS_POOL_MAX_LIFETIME_SECONDS', '3600'))
+        self.db_pool_health_check_interval = float(os.getenv('DATABRICKS_POOL_HEALTH_CHECK_SECONDS', '60'))
+        
+        # Embedding cache settings
+        self.embedding_cache_size = int(os.getenv('EMBEDDING_CACHE_SIZE', '2048'))
+        self.embedding_cache_path = os.getenv('EMBEDDING_CACHE_PATH')
+        self.embedding_batch_size = int(os.getenv('EMBEDDING_BATCH_SIZE', '16'))
+        self.embedding_batch_wait_ms = float(os.getenv('EMBEDDING_BATCH_WAIT_MS', '5'))
+        
+        # Entra ID token validation settings
+        self.jwks_url = os.getenv('AD_JWKS_URL', 'https://login.microsoftonline.com/{tenant_id}/discovery/v2.0/keys')
+        self.token_issuer = os.getenv('AD_TOKEN_ISSUER', 'https://login.microsoftonline.com/{tenant_id}/v2.0')
+        self.jwks_cache_ttl = float(os.getenv('JWKS_CACHE_TTL_SECONDS', '3600'))
+        self.jwks_min_refresh_interval = float(os.getenv('JWKS_MIN_REFRESH_SECONDS', '30'))
+        self.jwks_fetch_timeout = float(os.getenv('JWKS_FETCH_TIMEOUT_SECONDS', '10'))
+        self.token_cache_size = int(os.getenv('VERIFIED_TOKEN_CACHE_SIZE', '1024'))
+        
+        # Chat history token budgets per prompt stage
+        self.history_token_budgets = json.loads(os.getenv('HISTORY_TOKEN_BUDGETS', json.dumps({
+            "intent": 2000,
+            "research_retriever": 1500,
+            "rephraser": 1500,
+            "column_retriever": 1000,
+            "query_generator": 1500
+        })))
+        self.history_recent_field_tokens = int(os.getenv('HISTORY_RECENT_FIELD_TOKENS', '400'))
+        self.history_older_field_tokens = int(os.getenv('HISTORY_OLDER_FIELD_TOKENS', '120'))
+        self.history_cache_size = int(os.getenv('HISTORY_CACHE_SIZE', '1000'))
+        
+        # Structured response generation: "native" binds the response model to the LLM, "parser" uses format instructions
+        self.structured_output_mode = os.getenv('STRUCTURED_OUTPUT_MODE', 'parser').lower()
+        self.structured_output_method = os.getenv('STRUCTURED_OUTPUT_METHOD', 'json_schema')
+        
+        # Serve /api/agent/v1 from the async endpoint (sync pipeline steps offloaded to PIPELINE_WORKERS threads), false streams the sync generator through the starlette threadpool
+        self.async_pipeline_enabled = os.getenv('ASYNC_PIPELINE_ENABLED', 'true').lower() == 'true'
+        
+        # Semantic answer cache settings
+        self.answer_cache_enabled = os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() == 'true'
+        self.answer_cache_similarity_threshold = float(os.getenv('ANSWER_CACHE_SIMILARITY_THRESHOLD', '0.97'))
+        self.answer_cache_ttl = float(os.getenv('ANSWER_CACHE_TTL_SECONDS', '86400'))
+        self.answer_cache_max_entries = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '500'))
+        
+        # SQL result cache settings, per-table TTLs as JSON e.g. {"sem_hpsa_dental": 3600}
+        self.query_cache_enabled = os.getenv('QUERY_CACHE_ENABLED', 'true').lower() == 'true'
+        self.query_cache_max_entries = int(os.getenv('QUERY_CACHE_MAX_ENTRIES', '2000'))
+        self.query_cache_ttl = float(os.getenv('QUERY_CACHE_TTL_SECONDS', '21600'))
+        self.query_cache_table_ttls = {table.lower(): float(ttl) for table, ttl in json.loads(os.getenv('QUERY_CACHE_TABLE_TTLS', '{}')).items()}
+        
+        # Caps on SQL results returned to the agent scratchpad
+        self.sql_result_max_rows = int(os.getenv('SQL_RESULT_MAX_ROWS', '200'))
+        self.sql_result_max_bytes = int(os.getenv('SQL_RESULT_MAX_BYTES', '32000'))
+        self.sql_result_fetch_size = int(os.getenv('SQL_RESULT_FETCH_SIZE', '100'))
+        self.sql_result_inject_limit = os.getenv('SQL_RESULT_INJECT_LIMIT', 'true').lower() == 'true'
+        
+        # Metadata snapshot cache settings
+        self.metadata_datasources = [datasource.strip() for datasource in os.getenv('METADATA_DATASOURCES', 'ahrf,hpsa,sohea,merative').split(',') if datasource.strip()]
+        self.metadata_cache_ttl = float(os.getenv('METADATA_CACHE_TTL_SECONDS', '3600'))
+        self.metadata_refresh_interval = float(os.getenv('METADATA_REFRESH_INTERVAL_SECONDS', '21600'))
+        self.metadata_empty_ttl = float(os.getenv('METADATA_EMPTY_TTL_SECONDS', '30'))
+        self.metadata_warm_on_startup = os.getenv('METADATA_WARM_ON_STARTUP', 'true').lower() == 'true'
+        # Local intent pre-classifier: off, shadow (compare with the LLM only) or on (skip the LLM for confident turns)
+        self.intent_prefilter_mode = os.getenv('INTENT_PREFILTER_MODE', 'off').lower()
+        self.intent_exemplars_path = os.getenv('INTENT_EXEMPLARS_PATH', 'intent_exemplars.json')
+        self.intent_prefilter_similarity_threshold = float(os.getenv('INTENT_PREFILTER_SIMILARITY_THRESHOLD', '0.9'))
+        self.intent_prefilter_margin = float(os.getenv('INTENT_PREFILTER_MARGIN', '0.05'))
+        # Resolve turns that have chat history locally too, only after shadow mode shows agreement on such turns
+        self.intent_prefilter_resolve_with_history = os.getenv('INTENT_PREFILTER_RESOLVE_WITH_HISTORY', 'false').lower() == 'true'
+        self.intent_decision_log = os.getenv('INTENT_DECISION_LOG')
+        
+        # Startup warm-up of the agent pipeline and backend clients: off, background or blocking
+        self.startup_warm_up = os.getenv('STARTUP_WARM_UP', 'background').lower()
+        
+        # Structured logging, payload logs (prompts, histories, responses) are sampled and size capped
+        self.log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
+        self.log_file = os.getenv('LOG_FILE')
+        self.log_queue_size = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+        self.log_max_message_chars = int(os.getenv('LOG_MAX_MESSAGE_CHARS', '4000'))
+        self.log_payload_max_chars = int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '2000'))
+        self.log_payload_sample_rate = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0.1'))
+        
+        # Bearer token required on /metrics (the endpoint is outside the Entra auth dependency), unset disables /metrics
+        self.metrics_scrape_token = os.getenv('METRICS_SCRAPE_TOKEN')
+        
+        # OpenTelemetry tracing: none, console or otlp
+        self.tracing_exporter = os.getenv('TRACING_EXPORTER', 'none')
+        self.tracing_service_name = os.getenv('TRACING_SERVICE_NAME', 'ai-data-explorer')
+        self.tracing_otlp_endpoint = os.getenv('TRACING_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+        
+        self.stage_dag_workers = int(os.getenv('STAGE_DAG_WORKERS', '4'))
+        # Structured response calls running alongside final answer streaming
+        self.structured_response_workers = int(os.getenv('STRUCTURED_RESPONSE_WORKERS', '16'))
+        # Threads stepping the sync chat pipeline for the async endpoint (thread offload, LLM/Search/Databricks calls stay blocking).
+        # Each in-flight chat holds one thread while a step runs, chats beyond the limit wait for a free thread.
+        # Defaults to LLM_MAX_CONNECTIONS, more concurrent steps would only queue on the LLM connection pool.
+        self.pipeline_workers = max(1, int(os.getenv('PIPELINE_WORKERS', str(self.llm_max_connections))))
         
         self.model_input_cost = os.getenv('OPENAI_MODEL_INPUT_COST')
         self.model_output_cost = os.getenv('OPENAI_MODEL_OUTPUT_COST')
@@ -69,18 +187,33 @@ class Settings:
 
 settings = Settings()
 
-with open('medical_codes.json', 'r') as file:
-    medical_codes = json.load(file)
+def _load_medical_codes():
+    with open('medical_codes.json', 'r') as file:
+        return json.load(file)
 
-medical_codes_json_keys = medical_codes.keys()
+def _load_tooth_codes():
+    try:
+        with open('tooth_codes.json', 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        print("tooth_codes.json not found, initializing as empty dict.")
+        return {}
 
-try:
-    with open('tooth_codes.json', 'r') as file:
-        tooth_codes = json.load(file)
-except FileNotFoundError:
-    tooth_codes = {}
-    print("tooth_codes.json not found, initializing as empty dict.")
+# Code files are read on first access (PEP 562) instead of at import
+_lazy_attributes = {
+    "medical_codes": _load_medical_codes,
+    "medical_codes_json_keys": lambda: __getattr__("medical_codes").keys(),
+    "tooth_codes": _load_tooth_codes,
+    "tooth_codes_json_keys": lambda: __getattr__("tooth_codes").keys(),
+}
 
-tooth_codes_json_keys = tooth_codes.keys()
+def __getattr__(name):
+    if name not in _lazy_attributes:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if name in globals():
+        return globals()[name]
+    value = _lazy_attributes[name]()
+    globals()[name] = value
+    return value
 
 print(f'Initial Check! LLM Config type: {type(settings.LLM_Config)}')
\ No newline at end of file
@@ -0,0 +1,141 @@
+"""
+Offline evaluation of the local intent pre-classifier against logged LLM intent decisions (INTENT_DECISION_LOG)
+
+The log is split into a train and a test part (by time or by session). Exemplars are exported from the
+train part and scores are computed on the test part, exemplars with the same text as a scored prompt are ignored.
+
+    python intent_eval.py decisions.jsonl --export-exemplars intent_exemplars.json [--split time|session|none]
+    python intent_eval.py decisions.jsonl [--split time|session|none] [--thresholds 0.85 0.9 0.95] [--margin 0.05]
+"""
+
+from services.common.intent_prefilter import IntentPreClassifier, FOLLOW_UP, DIRECT, STANDALONE, label_from_decision, decisions_agree
+from services.common.utils import sample_user_prompts
+from collections import Counter
+from config import settings
+import argparse
+import hashlib
+import json
+import sys
+
+def load_decisions(path):
+    with open(path, "r") as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    return [record for record in records if record.get("userPrompt") and isinstance(record.get("decision"), dict)]
+
+def split_decisions(records, split, test_fraction):
+    """
+    Returns (train, test). time: the latest test_fraction of turns are the test part.
+    session: whole sessions are assigned to one part by a hash of the sessionId. none: every turn is in both parts.
+    """
+    if split == "none":
+        return records, records
+    if split == "time":
+        ordered = sorted(records, key=lambda record: record.get("timestamp") or 0)
+        cut = len(ordered) - max(1, int(round(len(ordered) * test_fraction)))
+        return ordered[:cut], ordered[cut:]
+    train, test = [], []
+    for record in records:
+        digest = hashlib.sha256(str(record.get("sessionId")).encode("utf-8")).digest()
+        (test if digest[0] / 256 < test_fraction else train).append(record)
+    return train, test
+
+def export_exemplars(records, path):
+    """Labels each logged prompt from its LLM decision, the latest decision wins for repeated prompts."""
+    exemplars = {}
+    for record in records:
+        label = label_from_decision(record["decision"])
+        exemplar = {"text": record["userPrompt"], "label": label}
+        if label == DIRECT:
+            exemplar["response"] = record["decision"]["response"]
+        exemplars[record["userPrompt"].strip().lower()] = exemplar
+    with open(path, "w") as file:
+        json.dump(list(exemplars.values()), file, indent=4)
+    print(f"Wrote {len(exemplars)} exemplars to {path}: {dict(Counter(exemplar['label'] for exemplar in exemplars.values()))}")
+
+def evaluate(classifier, records, predictions, threshold, margin, show):
+    resolved = agreed = 0
+    per_label = Counter()
+    per_label_agreed = Counter()
+    disagreements = []
+    for record, prediction in zip(records, predictions):
+        confident = (
+            prediction["label"] not in (None, FOLLOW_UP)
+            and prediction["similarity"] >= threshold
+            and prediction["margin"] >= margin
+        )
+        if not confident:
+            continue
+        resolved += 1
+        per_label[prediction["label"]] += 1
+        if decisions_agree(classifier.decision(record["userPrompt"], prediction), record["decision"]):
+            agreed += 1
+            per_label_agreed[prediction["label"]] += 1
+        else:
+            disagreements.append((record, prediction))
+
+    total = len(records)
+    print(f"\nthreshold {threshold:.2f} margin {margin:.2f}")
+    print(f"  resolved locally: {resolved}/{total} ({resolved / total:.1%}), LLM calls saved")
+    print(f"  agreement with LLM: {agreed}/{resolved} ({agreed / resolved if resolved else 0:.1%})")
+    for label in (STANDALONE, DIRECT):
+        if per_label[label]:
+            print(f"    {label:<11} resolved {per_label[label]:>5}  agree {per_label_agreed[label] / per_label[label]:.1%}")
+    for record, prediction in disagreements[:show]:
+        print(f"    disagree: {record['userPrompt'][:80]!r} local={prediction['label']} ({prediction['similarity']:.3f}) llm={label_from_decision(record['decision'])}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Agreement of the local intent pre-classifier with logged LLM decisions")
+    parser.add_argument("decisions", help="JSON lines written by INTENT_DECISION_LOG")
+    parser.add_argument("--exemplars", default=settings.intent_exemplars_path, help="Exemplar file to evaluate")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[settings.intent_prefilter_similarity_threshold])
+    parser.add_argument("--margin", type=float, default=settings.intent_prefilter_margin)
+    parser.add_argument("--show", type=int, default=10, help="Disagreements listed per threshold")
+    parser.add_argument("--export-exemplars", help="Write exemplars labelled from the train part of the log to this path and exit")
+    parser.add_argument("--split", choices=["time", "session", "none"], default="time", help="Train/test split of the log (default time)")
+    parser.add_argument("--resolve-with-history", action="store_true", default=settings.intent_prefilter_resolve_with_history,
+                        help="Score turns with chat history too (INTENT_PREFILTER_RESOLVE_WITH_HISTORY)")
+    parser.add_argument("--test-fraction", type=float, default=0.2, help="Share of turns (time) or sessions (session) held out for scoring")
+    args = parser.parse_args()
+
+    records = load_decisions(args.decisions)
+    if not records:
+        print(f"No intent decisions in {args.decisions}", file=sys.stderr)
+        return 1
+    train, test = split_decisions(records, args.split, args.test_fraction)
+    split_note = (
+        "split none: every logged turn is scored" if args.split == "none"
+        else f"split {args.split}: {len(train)} train turns, {len(test)} test turns (test fraction {args.test_fraction})"
+    )
+    if args.export_exemplars:
+        # Only the train part becomes exemplars, the test part stays unseen for scoring
+        print(split_note)
+        export_exemplars(train, args.export_exemplars)
+        return 0
+    if not test:
+        print(f"No test turns with {split_note}", file=sys.stderr)
+        return 1
+
+    # Embeddings go through the same cached connector as the chat pipeline
+    from services.agent_tools import cached_embeddings
+    classifier = IntentPreClassifier(
+        cached_embeddings.embed_query,
+        args.exemplars,
+        min(args.thresholds),
+        args.margin,
+        seed_exemplars=[{"text": prompt, "label": STANDALONE} for prompt in sample_user_prompts()],
+        resolve_with_history=args.resolve_with_history
+    )
+    # Predictions do not depend on the threshold, computed once and scored per threshold.
+    # leave_out: an exemplar with the scored prompt's own text would match it at similarity 1.0
+    predictions = [
+        classifier.predict(record["userPrompt"], record.get("has_history", False), leave_out=True) for record in test
+    ]
+    print(f"Intent pre-classifier evaluation: {len(test)} scored turns, {classifier.stats()['exemplars']} exemplars from {args.exemplars}")
+    print(f"{split_note}, exemplars matching the scored prompt text are left out")
+    print(f"LLM decisions: {dict(Counter(label_from_decision(record['decision']) for record in test))}")
+    for threshold in sorted(args.thresholds):
+        evaluate(classifier, test, predictions, threshold, args.margin, args.show)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,23 @@
 """Generator function for retrieval-augmented generation (RAG)"""
 
-from langchain.prompts import PromptTemplate
 from langchain.agents import create_react_agent,AgentExecutor
 from langchain_core.agents import AgentAction
-from services.prompts import user_prompt_rephraser,column_retriever, \
-query_response_generator,final_response_generator,intent_classifier,research_explorer,sohea_classifier,validation_agent
 
-from langchain_openai import AzureChatOpenAI
-from services.agent_tools_ import tools_,meta_data_tools_,sql_query_executor,sohea_agent_tools_
+from services.common.llm_clients import get_llm_connectors,get_structured_connector
+from services.agent_tools import tools as tools_,meta_data_tools_,sql_query_executor,execute_sql,sohea_agent_tools_,cached_embeddings
+from services.common.answer_cache import answer_cache
 import ast
 from datetime import datetime
 import json
-from services.common.utils import message_client,session_client,logger,source_specific_user_prompts
+from services.common.utils import message_client,session_client,source_specific_user_prompts,sample_user_prompts
+from services.common.intent_prefilter import IntentPreClassifier,STANDALONE,record_intent_decision
+from app_logger import get_request_logger
+from services.common.persistence import chat_persistence_queue
+from services.common.history import history_compactor
+from services.common.prompt_registry import prompt_registry,DATASOURCE_INSTRUCTIONS
+from services.common.json_repair import json_repairer
+from services.common import tracing
+from services.common.metrics import record_llm_usage,component_stats
 from typing import List, Optional, Union, Literal
 from pydantic import BaseModel,Field
 from pydantic import ValidationError
@@ -19,7 +25,10 @@ import traceback
 from typing import List, Optional, Union, Literal
 from langchain_core.output_parsers import PydanticOutputParser
 from config import settings,get_latest_sohea_year_file,get_year_check_configs
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import threading
+import contextvars
+import asyncio
 from tqdm import tqdm
 from zoneinfo import ZoneInfo
 from fastapi.responses import JSONResponse
@@ -48,6 +57,57 @@ class FinalResponseModel_Research_Explorer(BaseModel):
 
 parser = PydanticOutputParser(pydantic_object=FinalResponseModel)
 parser_research_explorer = PydanticOutputParser(pydantic_object=FinalResponseModel_Research_Explorer)
+FORMAT_INSTRUCTIONS = parser.get_format_instructions()
+RESEARCH_FORMAT_INSTRUCTIONS = parser_research_explorer.get_format_instructions()
+
+# Structured response generation overlaps the final answer stream
+structured_response_executor = ThreadPoolExecutor(max_workers=settings.structured_response_workers,thread_name_prefix='structured-response')
+
+# Threads stepping start_agent for the async endpoint (astart_agent), one per in-flight pipeline step (PIPELINE_WORKERS)
+pipeline_executor = ThreadPoolExecutor(max_workers=settings.pipeline_workers,thread_name_prefix='chat-pipeline')
+STREAM_END = object()
+
+# Local intent pre-classifier (INTENT_PREFILTER_MODE), the datasource sample questions seed its self-contained exemplars
+intent_pre_classifier = IntentPreClassifier(
+    cached_embeddings.embed_query,
+    settings.intent_exemplars_path,
+    settings.intent_prefilter_similarity_threshold,
+    settings.intent_prefilter_margin,
+    seed_exemplars=[{"text":prompt,"label":STANDALONE} for prompt in sample_user_prompts()],
+    resolve_with_history=settings.intent_prefilter_resolve_with_history
+    )
+component_stats.register("intent_prefilter",intent_pre_classifier.stats)
+
+class StageDAG():
+    """
+    Runs independent pipeline stages concurrently and joins them.
+    Each stage is a callable receiving the results of the stages it depends on.
+    """
+    def __init__(self,max_workers=None):
+        self.max_workers = max_workers or settings.stage_dag_workers
+        self.stages = {}
+
+    def add(self,name,func,depends_on=()):
+        self.stages[name] = (func,list(depends_on))
+
+    def run(self):
+        results = {}
+        if not self.stages:
+            return results
+        pending = dict(self.stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                ready = [name for name,(func,depends_on) in pending.items() if all(dep in results for dep in depends_on)]
+                if not ready and not running:
+                    raise ValueError(f"Unresolvable stage dependencies: {list(pending)}")
+                for name in ready:
+                    func,depends_on = pending.pop(name)
+                    running[executor.submit(func,{dep:results[dep] for dep in depends_on})] = name
+                done,_ = wait(running,return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        return results
 
 ...
 
@@ -61,51 +121,141 @@ class Main():
         self.rephrased_query = []
         self.userId = userId
         self.chatId=1
+        self.chat_id_claimed=False
+        self.history_last_chat_id=None
         self.streamed_response=''
         self.total_input_tokens=0
         self.total_output_tokens=0
+        self.token_lock=threading.Lock()
         self.application_name= 'AI Research Explorer' if datasource.lower()=='research' else 'AI Data Explorer'
         self.llm_config_key = next(
             (key for key in settings.LLM_Config.keys() if datasource.lower() in key.lower()),
             'default'  # default if no match found
             )
         self.model_name=settings.LLM_Config[self.llm_config_key]['model_name']
-        self.llm_connector = AzureChatOpenAI(
-            azure_deployment=settings.LLM_Config[self.llm_config_key]['deployment_name'],
-            api_version=settings.LLM_Config[self.llm_config_key]['api_version'],
-            azure_endpoint=settings.LLM_Config[self.llm_config_key]['endpoint'],
-            api_key = settings.LLM_Config[self.llm_config_key]['subscription_key'],
-            temperature=0,
-            max_tokens=None,
-            timeout=30,
-            max_retries=1,
+        self.llm_connector, self.llm_connector_agent = get_llm_connectors(self.llm_config_key)
+        # Session, datasource and chat id are attached to every log record of this request
+        self.logger = get_request_logger(sessionId=sessionId,datasource=datasource,userId=userId)
+        self.request_span=None
+        self.trace_context=None
+    
+    def start_request_span(self):
+        """
+        Root span of a chat request, stage spans are parented to it explicitly since stages run on worker threads
+        """
+        self.request_span = tracing.start_span(
+            'Chat Request',
+            datasource=self.dataSource,
+            **{"session.id":self.sessionId,"llm.model":self.model_name,"app.name":self.application_name}
             )
-        
-        self.llm_connector_agent = AzureChatOpenAI(
-            azure_deployment=settings.LLM_Config[self.llm_config_key]['deployment_name'],
-            api_version=settings.LLM_Config[self.llm_config_key]['api_version'],
-            azure_endpoint=settings.LLM_Config[self.llm_config_key]['endpoint'],
-            api_key = settings.LLM_Config[self.llm_config_key]['subscription_key'],
-            temperature=0,
-            max_tokens=None,
-            timeout=30,
-            max_retries=1,
-            model_kwargs={"stream_options": {"include_usage": True}}
-            
+        self.trace_context = tracing.context_with_span(self.request_span)
+    def end_request_span(self):
+        """
+        Ends the request span and records the request's token usage and cost once, storage_db runs several times per turn
+        """
+        input_cost , output_cost , total_cost = self.calculate_cost()
+        record_llm_usage(self.dataSource,self.model_name,self.total_input_tokens,self.total_output_tokens,input_cost,output_cost)
+        if self.request_span is not None:
+            tracing.set_span_attributes(
+                self.request_span,
+                **{"llm.input_tokens":self.total_input_tokens,"llm.output_tokens":self.total_output_tokens,"chat.id":self.chatId}
+                )
+            self.request_span.end()
+    def stage_span(self,stage_name,**attributes):
+        return tracing.stage_span(
+            str(stage_name),
+            parent=self.trace_context,
+            **{"datasource":self.dataSource,"session.id":self.sessionId,"llm.model":self.model_name,**attributes}
             )
-    
+    def pending_messages(self):
+        """
+        Messages of this session still in the write-behind queue, Cosmos does not return them yet
+        """
+        return chat_persistence_queue.pending((self.userId,self.sessionId))
     def get_current_chat_id(self):
         query = 'SELECT c.chatId from c ORDER BY c.chatId DESC OFFSET 0 LIMIT 1'
         msg_data = message_client.fetchRecord(query,[self.userId,self.sessionId])
+        chat_ids = [message['chatId'] for message in self.pending_messages()]
         if len(msg_data['response'])>0:
-            self.chatId=msg_data['response'][0]['chatId']+1
+            chat_ids.append(msg_data['response'][0]['chatId'])
+        if chat_ids:
+            self.chatId=max(chat_ids)+1
+        self.logger.bind(chatId=self.chatId)
     def fetch_previous_chat_info(self,cols):
         query = f'SELECT {cols} from c ORDER BY c.chatId DESC OFFSET 0 LIMIT 5'
         #filtering on sessionId and userEmail
         msg_data = message_client.fetchRecord(query,[self.userId,self.sessionId])
-        
-        print('Messages history: ',msg_data['response'])
-        return msg_data['response']
+        # Unpersisted messages replace their stored version, same columns as the query
+        fields = [col.strip().split('.',1)[-1] for col in cols.split(',')]
+        messages = {message['chatId']:message for message in msg_data['response']}
+        for message in self.pending_messages():
+            messages[message['chatId']] = {field:message.get(field) for field in fields}
+        previous_chat_info = sorted(messages.values(),key=lambda message: message['chatId'],reverse=True)[:5]
+        self.history_last_chat_id = previous_chat_info[0]['chatId'] if previous_chat_info else None
+
+        self.logger.payload('Messages history:',previous_chat_info)
+        return previous_chat_info
+
+    def compact_history(self,messages,stage):
+        """
+        Chat history bounded to the stage's token budget (HISTORY_TOKEN_BUDGETS), compacted once per session turn and reused by every stage
+        """
+        return history_compactor.compact(
+            (self.userId,self.sessionId),
+            self.history_last_chat_id,
+            messages,
+            settings.history_token_budgets.get(stage),
+            self.model_name
+            )
+
+    def intent_prompt(self,previous_chat_info):
+        if self.dataSource.lower()=='research':
+            return prompt_registry.format('research_explorer_intent_classifier',userPrompt=self.userPrompt,chat_history=self.compact_history(previous_chat_info,'intent'))
+        return prompt_registry.format('intent_classifier',userPrompt=self.userPrompt,chat_history=self.compact_history(previous_chat_info,'intent'))
+
+    def pre_classify_intent(self,has_history):
+        """
+        Local intent decision for confident turns (INTENT_PREFILTER_MODE=on), None defers the turn to the LLM classifier
+        """
+        if settings.intent_prefilter_mode!='on':
+            return None
+        try:
+            with self.stage_span('Intent Pre-Classifier') as span:
+                json_data = intent_pre_classifier.classify(self.userPrompt,has_history)
+                span.set_attributes({"intent.resolved_locally":json_data is not None})
+        except Exception as e:
+            self.logger.error("Intent pre-classifier failed, using the LLM classifier: %s", str(e))
+            return None
+        if json_data is not None:
+            self.logger.info('Intent resolved locally: %s',json_data['reason'])
+        return json_data
+
+    def record_intent_decision(self,has_history,json_data):
+        """
+        Logs the LLM intent decision (INTENT_DECISION_LOG), in shadow mode alongside the local prediction
+        """
+        local_prediction = None
+        if settings.intent_prefilter_mode=='shadow':
+            try:
+                local_prediction = intent_pre_classifier.shadow(self.userPrompt,has_history,json_data)
+                self.logger.info('Intent pre-classifier shadow prediction %s',local_prediction)
+            except Exception as e:
+                self.logger.error("Intent pre-classifier shadow prediction failed: %s", str(e))
+        record_intent_decision(self.dataSource,self.userPrompt,has_history,json_data,local_prediction,session_id=self.sessionId)
+
+    def classify_intent(self,previous_chat_info):
+        """
+        Routing decision for the turn, the local pre-classifier saves the LLM round-trip on confident turns
+        """
+        has_history = bool(previous_chat_info)
+        json_data = self.pre_classify_intent(has_history)
+        if json_data is not None:
+            return json_data
+        intent_response = self.invoke_llm(self.intent_prompt(previous_chat_info),stage_name='Intent Classifier')
+        self.logger.payload('..intent classifier',intent_response)
+        json_data = json.loads(intent_response)
+        self.record_intent_decision(has_history,json_data)
+        return json_data
 
     def invoke_llm(self,prompt_input,stage_name=False):
         """
@@ -113,21 +263,21 @@ class Main():
         """
         try:
             start_time = datetime.now()
-            with get_openai_callback() as cb:
+            with self.stage_span(stage_name) as span, get_openai_callback() as cb:
 
                 response = self.llm_connector.invoke([{"role": "user", "content": prompt_input}])
-                self.total_input_tokens+=cb.prompt_tokens
-                self.total_output_tokens+=cb.completion_tokens
+                with self.token_lock:
+                    self.total_input_tokens+=cb.prompt_tokens
+                    self.total_output_tokens+=cb.completion_tokens
+                tracing.record_token_usage(span,cb)
                 duration_ms = (datetime.now() - start_time).total_seconds() * 1000
                 log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} {stage_name} LLM Invoke - Input Tokens {cb.prompt_tokens} Output Tokens {cb.completion_tokens} TimeTaken: {duration_ms:.2f} ms"
-                print(log_str)
-                logger.info(log_str)
+                self.logger.info(log_str)
             return response.content
         except Exception as e:
-            print("Exception during Azure OpenAI call:\n%s", traceback.format_exc())
+            self.logger.error("Exception during Azure OpenAI call:\n%s", traceback.format_exc())
             log_str = f"Session ID {self.sessionId} Error occured while invoking LLM  {str(e)}"
-            print(log_str)
-            logger.error(log_str)
+            self.logger.error(log_str)
     def calculate_cost(self):
         INPUT_RATE = float(settings.LLM_Config[self.llm_config_key]['inputcost']) / 1_000_000    # $ per input token
         OUTPUT_RATE = float(settings.LLM_Config[self.llm_config_key]['outputcost']) / 1_000_000   # $ per output token
@@ -139,34 +289,95 @@ class Main():
 
         return cost_input,cost_output,total_cost
 
+    def structured_response_model(self):
+        if self.dataSource.lower()=='research':
+            return FinalResponseModel_Research_Explorer
+        return FinalResponseModel
+    def structured_output_instructions(self,fallback=False):
+        """
+        Format instructions for the structured response prompt, native structured output carries the schema itself
+        """
+        if settings.structured_output_mode=='native' and not fallback:
+            return ''
+        if self.dataSource.lower()=='research':
+            return RESEARCH_FORMAT_INSTRUCTIONS
+        return FORMAT_INSTRUCTIONS
+    def structured_output_fallback_prompt(self,prompt_input):
+        return f"""{prompt_input}
+        ##response_format_instructions
+        {self.structured_output_instructions(fallback=True)}
+        """
+    def structured_output_result(self,result,stage_name):
+        """
+        Native structured output result as JSON text, None when the model output could not be bound to the schema
+        """
+        if result.get('parsed') is not None:
+            return json.dumps(result['parsed'].dict())
+        log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} {stage_name} native structured output failed, falling back to parser: {result.get('parsing_error')}"
+        self.logger.info(log_str)
+        return None
+    def invoke_structured_llm(self,prompt_input,stage_name=False):
+        """
+        Invoke LLM for the structured response, native structured output with the free-text parser path as fallback
+        """
+        if settings.structured_output_mode!='native':
+            return self.invoke_llm(prompt_input,stage_name)
+        try:
+            start_time = datetime.now()
+            with self.stage_span(stage_name) as span, get_openai_callback() as cb:
+                result = get_structured_connector(self.llm_config_key,self.structured_response_model()).invoke([{"role": "user", "content": prompt_input}])
+                with self.token_lock:
+                    self.total_input_tokens+=cb.prompt_tokens
+                    self.total_output_tokens+=cb.completion_tokens
+                tracing.record_token_usage(span,cb)
+                duration_ms = (datetime.now() - start_time).total_seconds() * 1000
+                log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} {stage_name} Native Structured Output - Input Tokens {cb.prompt_tokens} Output Tokens {cb.completion_tokens} TimeTaken: {duration_ms:.2f} ms"
+                self.logger.info(log_str)
+            structured_response = self.structured_output_result(result,stage_name)
+            if structured_response is not None:
+                return structured_response
+        except Exception as e:
+            log_str = f"Session ID {self.sessionId} Error occured while invoking native structured output {str(e)}"
+            self.logger.error(log_str)
+        return self.invoke_llm(self.structured_output_fallback_prompt(prompt_input),stage_name)
+    def validate_structured_response(self,parsed_json):
+        if self.dataSource.lower()=='research':
+            validated = FinalResponseModel_Research_Explorer(**parsed_json)
+            final_response = validated.dict()
+            final_response['visualization']=None
+            final_response['sqlCode']=''
+            final_response['viewVisualization']=False
+        else:
+            validated = FinalResponseModel(**parsed_json)
+            final_response = validated.dict()
+        return final_response
+    def repair_and_validate(self,final_response):
+        """
+        Parses the structured response applying local JSON repairs first, raises when it still fails
+        """
+        parsed_json, repairs = json_repairer.repair(final_response)
+        if parsed_json is None:
+            # Surface the original decode error for the LLM fallback prompt
+            json.loads(final_response)
+        if repairs:
+            log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} JSON repaired locally: {repairs}"
+            self.logger.info(log_str)
+        if not isinstance(parsed_json, dict):
+            raise json.JSONDecodeError("Expected a JSON object", str(final_response), 0)
+        return self.validate_structured_response(parsed_json)
     def response_validator(self,final_response):
         MAX_RETRIES=5
         if final_response:
             try:
-                parsed_json = json.loads(final_response)
-                if "visualization" in parsed_json and parsed_json["visualization"] == {}:
-                    parsed_json["visualization"] = None
-                if self.dataSource.lower()=='research':
-                    validated = FinalResponseModel_Research_Explorer(**parsed_json)
-                    final_response = validated.dict()
-                    final_response['visualization']=None
-                    final_response['sqlCode']=''
-                    final_response['viewVisualization']=False
-                else:
-                    validated = FinalResponseModel(**parsed_json)
-                    final_response = validated.dict()
-                return final_response
+                return self.repair_and_validate(final_response)
             except (json.JSONDecodeError,ValidationError) as e:
                 ERROR_latest = str(e)
+                json_repairer.record_llm_fallback()
                 for attempt in range(1, MAX_RETRIES + 1):
                     
                     log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} Retrying JSON/Validation fix via LLM (Attempt {attempt}) Error details: {ERROR_latest}"
-                    print(log_str)
-                    logger.info(log_str)
-                    if self.dataSource.lower()=='research':
-                         format_instruction = parser_research_explorer.get_format_instructions()
-                    else:
-                         format_instruction = parser.get_format_instructions()
+                    self.logger.info(log_str)
+                    format_instruction = self.structured_output_instructions(fallback=True)
                     final_response=self.invoke_llm(f'''Verify the JSON Parse or Validation Error {ERROR_latest}
                         # Input:
                             {final_response}
@@ -180,22 +391,16 @@ class Main():
                         ''',
                         stage_name='Output Json Parser')
                     
-                    print("JSON..LLM",final_response)
+                    self.logger.payload('JSON..LLM',final_response)
                     try:
-                        parsed_json = json.loads(final_response)
-
-                        if "visualization" in parsed_json and parsed_json["visualization"] == {}:
-                            parsed_json["visualization"] = None
-                        validated = FinalResponseModel(**parsed_json)
-                        final_response = validated.dict()
-                        return final_response
+                        return self.repair_and_validate(final_response)
                     except (json.JSONDecodeError,ValidationError) as er:
                         ERROR_latest = str(er)
                 return None
         return None
-    def storage_db(self,final_response):
+    def chat_message(self,final_response):
         """
-        Chat history
+        Chat history record of this turn
         """
 
         final_response = self.response_validator(final_response)
@@ -224,21 +429,61 @@ class Main():
         final_response['total_cost']=total_cost
         final_response['dataSource']=self.dataSource
         final_response['applicationName']=self.application_name
-        try:
-             resp,status_code = message_client.insertRecord(final_response)
-             if status_code==409:
-                 resp = message_client.updateRecord(final_response['id'],final_response)
-             print('record insertion status ! ',resp)
-             payload = session_client.fetchRecord('select * from c',[self.userId,self.sessionId])['response'][0]
-             payload['lastUpdatedAt']=str(datetime.now(ZoneInfo("America/New_York")))
-             session_client.updateRecord(self.userId+'-'+self.sessionId,payload)
-        except Exception as e:
-            log_str = f"failed at Insertion / Updation of record ! {str(e)}"
-            print(log_str)
-            logger.error(log_str)
+        return final_response
+
+    def create_message(self):
+        """
+        Claims the turn's chatId with a conditional create, Cosmos answers 409 when another turn
+        (in this or any other process) already holds it and the next chatId is tried
+        """
+        self.get_current_chat_id()
+        for attempt in range(settings.chat_id_claim_attempts):
+            resp,status_code = message_client.insertRecord(self.chat_message(''))
+            if status_code==409:
+                self.logger.info('chatId %s already taken, claiming the next one',self.chatId)
+                self.chatId+=1
+                self.logger.bind(chatId=self.chatId)
+                continue
+            self.chat_id_claimed=True
+            if status_code!=200:
+                self.logger.error('Initial message insert failed, queued for retry: %s',resp.get('error'))
+                self.storage_db('')
+            return
+        raise RuntimeError(f"No free chatId for session {self.sessionId} after {settings.chat_id_claim_attempts} attempts")
+
+    def storage_db(self,final_response):
+        """
+        Chat history
+        """
+        final_response = self.chat_message(final_response)
+        if not self.chat_id_claimed:
+            # Writing an unclaimed chatId could overwrite another turn's message
+            return final_response
+        # Persisted off the streaming path, repeated writes of the same message coalesce into one upsert.
+        # Until written, the message is served to the chat id and history readers from the queue
+        message = dict(final_response)
+        chat_persistence_queue.enqueue(
+            final_response['id'],
+            lambda: self.persist_message(message),
+            group=(self.userId,self.sessionId),
+            value=message
+            )
 
         return final_response
 
+    def persist_message(self,message):
+        """
+        Upsert the chat message and touch the session's lastUpdatedAt (runs on the write-behind worker)
+        """
+        with self.stage_span('Cosmos Persist Message',**{"chat.id":message.get('chatId')}):
+            resp = message_client.upsertRecord(message)
+            self.logger.info('record insertion status ! %s',resp['status'])
+            session_client.patchRecord(
+                self.userId+'-'+self.sessionId,
+                [self.userId,self.sessionId],
+                [{"op":"set","path":"/lastUpdatedAt","value":str(datetime.now(ZoneInfo("America/New_York")))}]
+                )
+
     def agent_thoughts(self,agent_response):
         agent_steps=[]
         for step in agent_response:
@@ -271,69 +516,29 @@ class Main():
              )
     def start_agent(self):
 
+        self.start_request_span()
         try:
             yield ''
             #Initial Message Insertion
-            self.get_current_chat_id()
-            self.storage_db('')
+            self.create_message()
             #chat history
             agent_chat_info = []
             previous_chat_info = self.fetch_previous_chat_info('c.chatId,c.prompt,c.rephrasedPrompt,c.sqlCode,c.response')
 
+            structured_response_future=None
+            answer_cache_vector=None
+            answer_cache_version=None
+            answer_cache_query=None
             agent_steps_=[]
             agent_steps_.append(
                 {"user_question":self.userPrompt}
                 )
             sanitized_user_prompt = str(self.userPrompt).replace('\n','').replace('\r','')
             '''
-            Initialize variables for System Instructions
+            Datasource specific instructions, prompt templates are compiled once in prompt_registry
             '''
-            intent_prompt_template = PromptTemplate.from_template(intent_classifier.CLASSIFIER)
-            rephraser_prompt_template = PromptTemplate.from_template(user_prompt_rephraser.USER_PROMPT_REPHRASER)
-            year_validation_template = PromptTemplate.from_template(validation_agent.YEAR_Validation_)
-            agent_prompt_template_col_retriever = PromptTemplate.from_template(column_retriever.COLUMN_RETRIEVER_PROMPT)
-            agent_prompt_template_query_generator = PromptTemplate.from_template(query_response_generator.QUERY_GENERATOR_PROMPT)
-            final_response_generator_prompt = PromptTemplate.from_template(final_response_generator.RESPONSE_GENERATOR_)
-            structured_response_generator_prompt = PromptTemplate.from_template(final_response_generator.STRUCTURED_RESPONSE_GENERATOR_)
-            prompt_input_intent = intent_prompt_template.format(userPrompt=self.userPrompt,chat_history=previous_chat_info)
-            research_explorer_retriever_prompt = PromptTemplate.from_template(research_explorer.RESEARCH_EXPLORER_RETRIEVER)
-            research_explorer_decision_agent_prompt = PromptTemplate.from_template(research_explorer.DECISION_AGENT_PROMPT)
-            research_structured_response_generator_prompt = PromptTemplate.from_template(research_explorer.STRUCTURED_RESPONSE_GENERATOR_)
-            research_explorer_intent_response_prompt = PromptTemplate.from_template(research_explorer.INTENT_CLASSIFIER)
-            sohea_classifier_prompt = PromptTemplate.from_template(sohea_classifier.Denominator_classifier)
-            sohea_year_classifier_prompt_template = PromptTemplate.from_template(sohea_classifier.Year_Scope_classifier)
-            sohea_json_mapping_agent_prompt = PromptTemplate.from_template(sohea_classifier.hierachy_mapping_agent)
-            if self.dataSource.lower()=='research':
-                prompt_input_intent = research_explorer_intent_response_prompt.format(userPrompt=self.userPrompt,chat_history=previous_chat_info)
-            if self.dataSource.lower()=='ahrf':
-                prompt_rephraser_instructions = user_prompt_rephraser.AHRF_USER_PROMPT_REPHRASER
-                column_retriever_instructions = column_retriever.AHRF_COLUMN_RETRIEVER_PROMPT
-                query_response_generator_instructions = query_response_generator.AHRF_QUERY_GENERATOR_PROMPT
-                followup_suggestions= source_specific_user_prompts['ahrf']
-            elif self.dataSource.lower()=='hpsa':
-                prompt_rephraser_instructions = user_prompt_rephraser.HPSA_USER_PROMPT_REPHRASER
-                column_retriever_instructions = column_retriever.HPSA_COLUMN_RETRIEVER_PROMPT
-                query_response_generator_instructions = query_response_generator.HPSA_QUERY_GENERATOR_PROMPT
-                followup_suggestions=source_specific_user_prompts['hpsa']
-            elif self.dataSource.lower()=='merative':
-                prompt_rephraser_instructions = user_prompt_rephraser.MERATIVE_USER_PROMPT_REPHRASER
-                column_retriever_instructions = column_retriever.MERATIVE_COLUMN_RETRIEVER_PROMPT
-                query_response_generator_instructions = query_response_generator.MERATIVE_QUERY_GENERATOR_PROMPT
-                followup_suggestions=source_specific_user_prompts['merative']
-            elif self.dataSource.lower()=='sohea':
-                 prompt_rephraser_instructions = user_prompt_rephraser.SOHEA_USER_PROMPT_REPHRASER
-                 column_retriever_instructions = column_retriever.SOHEA_COLUMN_RETRIEVER_PROMPT
-                 query_response_generator_instructions = query_response_generator.SOHEA_QUERY_GENERATOR_PROMPT
-                 followup_suggestions=source_specific_user_prompts['sohea']
-            elif self.dataSource.lower()=='dqddma':
-                 prompt_rephraser_instructions = user_prompt_rephraser.DQ_DDMA_USER_PROMPT_REPHRASER
-                 column_retriever_instructions = column_retriever.DQ_DDMA_COLUMN_RETRIEVER_PROMPT
-                 query_response_generator_instructions = query_response_generator.DQ_DDMA_QUERY_GENERATOR_PROMPT
-                 followup_suggestions=source_specific_user_prompts.get('dqddma')
-            intent_response = self.invoke_llm(prompt_input_intent,stage_name='Intent Classifier')
-            print('..intent classifier',intent_response)
-            json_data = json.loads(intent_response)
-            print(json_data)
+            prompt_rephraser_instructions,column_retriever_instructions,query_response_generator_instructions,followup_suggestions = self.datasource_instructions()
+            json_data = self.classify_intent(previous_chat_info)
             rephraser_input=self.userPrompt
             if not json_data['run_downstream_llm'] and json_data['response']:
                 self.streamed_response+=json_data['response']
@@ -344,17 +549,16 @@ class Main():
                     if chat_message['chatId'] in json_data['chatId']:
                         agent_steps_.append(chat_message)
                 if self.dataSource.lower()=='research':
-                    prompt_input_structured_response_generator = research_structured_response_generator_prompt.format(
+                    prompt_input_structured_response_generator = prompt_registry.format('research_structured_response_generator',
                         AGENT_OUTPUTS=agent_steps_,
-                        response_format_instructions=parser_research_explorer.get_format_instructions(),
+                        response_format_instructions=self.structured_output_instructions(),
                         datasource_specific_user_prompts = followup_suggestions,
                         user_question=self.userPrompt
                         )
                 else:
-                    prompt_input_structured_response_generator = structured_response_generator_prompt.format(
+                    prompt_input_structured_response_generator = prompt_registry.format('structured_response_generator',self.dataSource,
                         AGENT_OUTPUTS=agent_steps_,
-                        response_format_instructions=parser.get_format_instructions(),
-                        datasource_specific_user_prompts = followup_suggestions,
+                        response_format_instructions=self.structured_output_instructions(),
                         user_question=self.userPrompt
                         )
             else:
@@ -363,43 +567,44 @@ class Main():
                     if chat_message['chatId'] in json_data['chatId']:
                          agent_chat_info.append(chat_message)
                 rephraser_input=json_data['rephrased_query']
-                print('...INTENT Classifier rephrased query',rephraser_input)
+                self.logger.info('...INTENT Classifier rephrased query %s',rephraser_input)
                 if self.dataSource.lower()=='research':
-                     research_explorer_decision_agent_prompt_ =research_explorer_decision_agent_prompt.format(
-                         user_question = f'Original Question: {self.userPrompt}' ,
-                         )
-                     decision_response = self.invoke_llm(research_explorer_decision_agent_prompt_,stage_name='Research-Explorer-Decision-LLM')
-                     print("Decision response" , decision_response)
-                     research_explorer_retriever_prompt_1 = research_explorer_retriever_prompt.partial(
-                     user_question = f'Original Question: {self.userPrompt}',
-                     original_rephrased_question = f'Original Question: {self.userPrompt}   rephrased prompt: {rephraser_input}',
-                     decision_response=decision_response,
-                     chat_history=agent_chat_info
-                     
-                     )
-                     summary_agent = create_react_agent(
-                         self.llm_connector_agent,
-                         meta_data_tools_,
-                         research_explorer_retriever_prompt_1
-                         )
-                     research_explorer_agent = self.agent_executor(summary_agent,meta_data_tools_)
-                     
-                     with get_openai_callback() as cb:
-                     with get_openai_callback() as cb:
+                    research_explorer_decision_agent_prompt_ =prompt_registry.format('research_explorer_decision_agent',
+                        user_question = f'Original Question: {self.userPrompt}' ,
+                        )
+                    decision_response = self.invoke_llm(research_explorer_decision_agent_prompt_,stage_name='Research-Explorer-Decision-LLM')
+                    self.logger.payload('Decision response',decision_response)
+                    research_explorer_retriever_prompt_1 = prompt_registry.partial('research_explorer_retriever',
+                        user_question = f'Original Question: {self.userPrompt}',
+                        original_rephrased_question = f'Original Question: {self.userPrompt}   rephrased prompt: {rephraser_input}',
+                        decision_response=decision_response,
+                        chat_history=self.compact_history(agent_chat_info,'research_retriever')
+                        )
+                    summary_agent = create_react_agent(
+                        self.llm_connector_agent,
+                        meta_data_tools_,
+                        research_explorer_retriever_prompt_1
+                        )
+                    research_explorer_agent = self.agent_executor(summary_agent,meta_data_tools_)
+
+                    start_time_research_agent = datetime.now()
+                    with self.stage_span('Research-Explorer Agent') as span, get_openai_callback() as cb:
                         research_explorer_agent_response = research_explorer_agent.stream({"input": f'Original Question: {self.userPrompt} Rephrased Query: {self.rephrased_query}'})
                         summary_output,research_explorer_agent_steps = self.agent_thoughts(research_explorer_agent_response)
                         self.total_input_tokens += cb.prompt_tokens
                         self.total_output_tokens += cb.completion_tokens
+                        tracing.record_token_usage(span,cb)
+                        duration_ms = (datetime.now() - start_time_research_agent).total_seconds() * 1000
                         log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} Research-Explorer Agent Input Tokens {cb.prompt_tokens} Output Tokens {cb.completion_tokens} TimeTaken: {duration_ms:.2f} ms"
-                        print(log_str)
-                        logger.info(log_str)
-                        yield summary_output
-                        self.streamed_response=summary_output
-                        agent_steps_.append(research_explorer_agent_steps)
+                        self.logger.info(log_str)
+                    # Streamed after the span ends, the client may hold the generator between chunks
+                    yield summary_output
+                    self.streamed_response=summary_output
+                    agent_steps_.append(research_explorer_agent_steps)
                     
-                    prompt_input_structured_response_generator = research_structured_response_generator_prompt.format(
+                    prompt_input_structured_response_generator = prompt_registry.format('research_structured_response_generator',
                         AGENT_OUTPUTS=agent_steps_,
-                        response_format_instructions=parser_research_explorer.get_format_instructions(),
+                        response_format_instructions=self.structured_output_instructions(),
                         decision_response = decision_response
                         )
                 else:
@@ -408,40 +613,77 @@ class Main():
                     Query Rephraser
                     '''
                     log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} Rephrasing user prompt:  {sanitized_user_prompt}"
-                    print(log_str)
-                    logger.info(log_str)
+                    self.logger.info(log_str)
 
-                    prompt_input_rephraser = rephraser_prompt_template.format(
-                        datasource_specific_instructions=prompt_rephraser_instructions,
+                    prompt_input_rephraser = prompt_registry.format('user_prompt_rephraser',self.dataSource,
                         user_question=rephraser_input,
-                        chat_history=agent_chat_info
+                        chat_history=self.compact_history(agent_chat_info,'rephraser')
                         )
                     
                     self.rephrased_query=self.invoke_llm(prompt_input_rephraser,stage_name='User Prompt rephraser')
 
                     log_str = f"Session Id {self.sessionId} Datasource {self.dataSource}Rephrased user prompt:  {self.rephrased_query}"
-                    print(log_str)
-                    logger.info(log_str)
+                    self.logger.info(log_str)
 
-                    print("Rephrased Query : ",self.rephrased_query,type(self.rephrased_query))
+                    self.logger.info("Rephrased Query : %s",self.rephrased_query)
 
                     agent_steps_.append(
                         {"rephrasedQueries":self.rephrased_query}
                         )
                     self.rephrased_query = ast.literal_eval(self.rephrased_query)
-                    print(type(self.rephrased_query))
 
-                    # Year Validation Check
+                    # Semantic answer cache, only for standalone questions (no prior chat context)
+                    if settings.answer_cache_enabled and not agent_chat_info:
+                        answer_cache_version = answer_cache.catalog_version(self.dataSource)
+                        answer_cache_query = self.answer_cache_query()
+                        answer_cache_vector = cached_embeddings.embed_query(answer_cache_query)
+                        cached_answer = answer_cache.lookup(self.dataSource, answer_cache_vector, answer_cache_query)
+                        tracing.set_span_attributes(self.request_span,**{"answer_cache.hit":cached_answer is not None})
+                        if cached_answer:
+                            log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} Answer cache hit similarity {cached_answer['similarity']:.4f}"
+                            self.logger.info(log_str)
+                            self.streamed_response+=cached_answer['streamed_response']
+                            yield cached_answer['streamed_response']
+                            structured_response = self.storage_db(json.dumps(cached_answer['structured_response']))
+                            yield json.dumps(structured_response)
+                            return ''
+
+                    # Year Validation Check + SOHEA classifiers run as one stage DAG
                     year_check_configs = get_year_check_configs()
                     current_source = self.dataSource.lower()
+                    stages = StageDAG()
                     if current_source in year_check_configs:
-                        print(f"---Starting Year validation for {current_source.upper()} ---")
+                        self.logger.info("---Starting Year validation for %s ---",current_source.upper())
                         year_validation_sql = year_check_configs[current_source]['sql']
-                        years_available = sql_query_executor(year_validation_sql)
-                        print(f"Years Available {years_available}")
-                        year_validation_prompt = year_validation_template.format(userPrompt=self.rephrased_query,years_available=years_available)
-                        is_year_present_llm_response = self.invoke_llm(year_validation_prompt,stage_name='Validating required params')
-                        print(f'Is Year present? {is_year_present_llm_response}')
+                        stages.add('years_available', lambda results: sql_query_executor(year_validation_sql,self.dataSource))
+                        stages.add(
+                            'year_validation',
+                            lambda results: self.invoke_llm(
+                                prompt_registry.format('year_validation',userPrompt=self.rephrased_query,years_available=results['years_available']),
+                                stage_name='Validating required params'),
+                            depends_on=['years_available']
+                            )
+                    if current_source == 'sohea':
+                        '''Single/multi year Classifier'''
+                        stages.add(
+                            'sohea_year_classifier',
+                            lambda results: self.invoke_llm(
+                                prompt_registry.format('sohea_year_classifier',userPrompt=self.rephrased_query),
+                                stage_name='Sohea Year Scope Classifier')
+                            )
+                        '''Denominator Classifier'''
+                        stages.add(
+                            'sohea_denominator_classifier',
+                            lambda results: self.invoke_llm(
+                                prompt_registry.format('sohea_denominator_classifier',userPrompt=self.rephrased_query),
+                                stage_name='Sohea Donominator Classifier')
+                            )
+                    stage_results = stages.run()
+
+                    if 'year_validation' in stage_results:
+                        self.logger.info("Years Available %s",stage_results['years_available'])
+                        is_year_present_llm_response = stage_results['year_validation']
+                        self.logger.info('Is Year present? %s',is_year_present_llm_response)
                         is_year_present_llm_response = json.loads(is_year_present_llm_response)
                         if not is_year_present_llm_response['is_year_present']:
                             # yield 'Please select year from followup-suggestions'
@@ -454,19 +696,14 @@ class Main():
                             return ''
 
                     if self.dataSource.lower() == 'sohea':
-                        '''Single/multi year Classifier'''
-                        sohea_year_classifier_prompt = sohea_year_classifier_prompt_template.format(userPrompt=self.rephrased_query)
-                        sohea_year_classifier_response = json.loads(self.invoke_llm(sohea_year_classifier_prompt,stage_name='Sohea Donominator Classifier'))
-
-                        '''Denominator Classifier'''
-                        sohea_denominator_classifier_prompt = sohea_classifier_prompt.format(userPrompt=self.rephrased_query)
-                        sohea_denominator_classifier_response = json.loads(self.invoke_llm(sohea_denominator_classifier_prompt,stage_name='Sohea Donominator Classifier'))
+                        sohea_year_classifier_response = json.loads(stage_results['sohea_year_classifier'])
+                        sohea_denominator_classifier_response = json.loads(stage_results['sohea_denominator_classifier'])
 
                         if sohea_year_classifier_response['year_scope']=='unknown':
                             latest_year , latest_file = get_latest_sohea_year_file()
                             sohea_year_classifier_response['years']=[latest_year]
-                        print(f'Sohea classifier response : {sohea_denominator_classifier_response}')
-                        print(f'Sohea year scope classifier response : {sohea_year_classifier_response}')
+                        self.logger.info('Sohea classifier response : %s',sohea_denominator_classifier_response)
+                        self.logger.info('Sohea year scope classifier response : %s',sohea_year_classifier_response)
 
                         column_retriever_instructions=column_retriever_instructions+f'''
                         YearNumbers {sohea_year_classifier_response['years']}
@@ -474,7 +711,7 @@ class Main():
                         ...
                         'when denominator -- true -- Agent -- JSON -- Mapping '
                         if sohea_denominator_classifier_response['denominator_required']:
-                            sohea_mapping_agent_prompt = sohea_json_mapping_agent_prompt.partial(
+                            sohea_mapping_agent_prompt = prompt_registry.partial('sohea_mapping_agent',
                                 question = f'Original Question: {self.userPrompt} Rephrased Query: {self.rephrased_query} Datasource {self.dataSource} Years_requested : {sohea_year_classifier_response['years']}',
                                 
                                 )
@@ -487,22 +724,20 @@ class Main():
                             heirarchy_mapping_agent =self.agent_executor(heirarchy_agent,sohea_agent_tools_)
 
                             log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} executing heirarchy agent to retrieve questions."
-                            print(log_str)
-                            logger.info(log_str)
+                            self.logger.info(log_str)
                             start_time_column_agent = datetime.now()
-                            with get_openai_callback() as cb:
+                            with self.stage_span('Sohea Hierarchy Mapping Agent') as span, get_openai_callback() as cb:
                                 heirarchy_mapping_agent_response = heirarchy_mapping_agent.stream({"input": f'Original Question: {self.userPrompt} Rephrased Query: {self.rephrased_query}'})
                                 mapping_logic,ai_search_agent_steps = self.agent_thoughts(heirarchy_mapping_agent_response)
                                 self.total_input_tokens += cb.prompt_tokens
                                 self.total_output_tokens += cb.completion_tokens
+                                tracing.record_token_usage(span,cb)
                                 duration_ms = (datetime.now() - start_time_column_agent).total_seconds() * 1000
                                 log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} heirarchy_mapping_agent Input Tokens {cb.prompt_tokens} Output Tokens {cb.completion_tokens} TimeTaken: {duration_ms:.2f} ms"
-                                print(log_str)
-                                logger.info(log_str)
+                                self.logger.info(log_str)
 
                             log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} recieved output response from heirarchy_mapping_agent."
-                            print(log_str)
-                            logger.info(log_str)
+                            self.logger.info(log_str)
 
                             column_retriever_instructions=column_retriever_instructions+f"""
                             MUST INSTRUCT DOWNSTREAM LLM TO USE BELOW **Denominator** & **Numerator** logic 
@@ -516,11 +751,11 @@ class Main():
                     '''
                     React Agent - > AI Search & Relevant Columns extractor
                     '''
-                    print(f"Session Id {self.sessionId} Datasource {self.dataSource} creating search agent to retrieve columns ")
-                    agent_prompt_col_retriever = agent_prompt_template_col_retriever.partial(
+                    self.logger.info(f"Session Id {self.sessionId} Datasource {self.dataSource} creating search agent to retrieve columns ")
+                    agent_prompt_col_retriever = prompt_registry.partial('column_retriever',self.dataSource,
                         question = f'Original Question: {self.userPrompt} Rephrased Query: {self.rephrased_query} Datasource {self.dataSource}',
                         data_source_specific_instruction=column_retriever_instructions,
-                        chat_history=agent_chat_info
+                        chat_history=self.compact_history(agent_chat_info,'column_retriever')
                         )
                     search_agent = create_react_agent(
                         self.llm_connector_agent,
@@ -531,22 +766,20 @@ class Main():
                     column_retriever_agent =self.agent_executor(search_agent,meta_data_tools_)
 
                     log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} executing search agent to retrieve columns."
-                    print(log_str)
-                    logger.info(log_str)
+                    self.logger.info(log_str)
                     start_time_column_agent = datetime.now()
-                    with get_openai_callback() as cb:
+                    with self.stage_span('Column Retriever Agent') as span, get_openai_callback() as cb:
                         column_retriever_agent_response = column_retriever_agent.stream({"input": f'Original Question: {self.userPrompt} Rephrased Query: {self.rephrased_query}'})
                         relevant_columns,ai_search_agent_steps = self.agent_thoughts(column_retriever_agent_response)
                         self.total_input_tokens += cb.prompt_tokens
                         self.total_output_tokens += cb.completion_tokens
+                        tracing.record_token_usage(span,cb)
                         duration_ms = (datetime.now() - start_time_column_agent).total_seconds() * 1000
                         log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} Column RetrieverAgent Input Tokens {cb.prompt_tokens} Output Tokens {cb.completion_tokens} TimeTaken: {duration_ms:.2f} ms"
-                        print(log_str)
-                        logger.info(log_str)
+                        self.logger.info(log_str)
                     
                     log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} recieved output response from search agent."
-                    print(log_str)
-                    logger.info(log_str)
+                    self.logger.info(log_str)
 
                     agent_steps_.append(
                         {"ai_search_agent":ai_search_agent_steps}
@@ -555,15 +788,13 @@ class Main():
                     React Agent - > SQL Query builder , Documents Retriever & Response Generator
                     '''
 
-                    agent_prompt_query_generator = agent_prompt_template_query_generator.partial(
-                        datasource_specific_instructions=query_response_generator_instructions,
+                    agent_prompt_query_generator = prompt_registry.partial('query_generator',self.dataSource,
                         question=f'Original Question: {self.userPrompt} Rephrased Query: {self.rephrased_query}',
                         parsed=relevant_columns,
-                        chat_history=agent_chat_info
+                        chat_history=self.compact_history(agent_chat_info,'query_generator')
                         )
                     log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} creating react agent to retrieve documents "
-                    print(log_str)
-                    logger.info(log_str)
+                    self.logger.info(log_str)
 
                     sql_agent = create_react_agent(
                         self.llm_connector_agent,
@@ -574,79 +805,93 @@ class Main():
                     agent_ex = self.agent_executor(sql_agent,tools_)
 
                     log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} executing react agent to retrieve documents "
-                    print(log_str)
-                    logger.info(log_str)
+                    self.logger.info(log_str)
 
                     sql_agent_steps=[]
                     start_time_query_agent = datetime.now()
-                    with get_openai_callback() as cb:
+                    with self.stage_span('SQL Agent') as span, get_openai_callback() as cb:
                         response_stream = agent_ex.stream({"input": f'Original Question: {self.userPrompt} Rephrased Query: {self.rephrased_query}'})
                         relevant_columns,sql_agent_steps = self.agent_thoughts(response_stream)
                         self.total_input_tokens += cb.prompt_tokens
                         self.total_output_tokens += cb.completion_tokens
+                        tracing.record_token_usage(span,cb)
                         duration_ms = (datetime.now() - start_time_query_agent).total_seconds() * 1000
                         log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} Query Generated Agent Input Tokens {cb.prompt_tokens} Output Tokens {cb.completion_tokens} TimeTaken: {duration_ms:.2f} ms"
-                        print(log_str)
-                        logger.info(log_str)
+                        self.logger.info(log_str)
 
 
                     agent_steps_.append(
                         {"sql_agent_steps":sql_agent_steps}
                         )
                     log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} query agent process completed Invoking final LLM for response generator"
-                    print(log_str)
-                    logger.info(log_str)
+                    self.logger.info(log_str)
                     '''
                     Final Response Generator -> Streaming response
                     '''
-                    prompt_input_response_generator = final_response_generator_prompt.format(
+                    prompt_input_response_generator = prompt_registry.format('response_generator',
                         AGENT_OUTPUTS=agent_steps_
                         )
-                    final_response=''
+                    prompt_input_structured_response_generator = prompt_registry.format('structured_response_generator',self.dataSource,
+                        AGENT_OUTPUTS=agent_steps_,
+                        response_format_instructions=self.structured_output_instructions(),
+                        user_question=self.userPrompt
+                        )
+                    # Structured prompt only depends on agent_steps_, generate it while the answer streams
+                    structured_response_future = structured_response_executor.submit(
+                        self.invoke_structured_llm,
+                        prompt_input_structured_response_generator,
+                        'Structured response generator'
+                        )
 
                     start_time_response_agent = datetime.now()
-                    with get_openai_callback() as cb:
-                        for chunk in self.llm_connector_agent.stream([{"role": "user", "content": prompt_input_response_generator}]):
-                            
-                            self.streamed_response+=chunk.content
-                            yield chunk.content
-                            self.total_input_tokens += cb.prompt_tokens
-                            self.total_output_tokens += cb.completion_tokens
+                    # Not made current, the stream yields to the client between chunks
+                    response_span = tracing.start_span('Response Generator',parent=self.trace_context,datasource=self.dataSource,**{"llm.model":self.model_name})
+                    try:
+                        with get_openai_callback() as cb:
+                            for chunk in self.llm_connector_agent.stream([{"role": "user", "content": prompt_input_response_generator}]):
+                                
+                                self.streamed_response+=chunk.content
+                                yield chunk.content
+                            with self.token_lock:
+                                self.total_input_tokens += cb.prompt_tokens
+                                self.total_output_tokens += cb.completion_tokens
+                            tracing.record_token_usage(response_span,cb)
                             duration_ms = (datetime.now() - start_time_response_agent).total_seconds() * 1000
                             log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} Response Generater Input Tokens {cb.prompt_tokens} Output Tokens {cb.completion_tokens} TimeTaken: {duration_ms:.2f} ms"
-                            print(log_str)
-                            logger.info(log_str)
+                            self.logger.info(log_str)
                             log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} Response generated successfuly"
-                            print(log_str)
-                            logger.info(log_str)
-
-                            print(final_response)
-                            prompt_input_structured_response_generator = structured_response_generator_prompt.format(
-                                AGENT_OUTPUTS=agent_steps_,
-                                response_format_instructions=parser.get_format_instructions(),
-                                datasource_specific_user_prompts = followup_suggestions,
-                                user_question=self.userPrompt
-                                )
+                            self.logger.info(log_str)
+                    finally:
+                        response_span.end()
                     
             '''
             Structured Response Generator -> JSON response with followup suggestions
             '''
             
-            structured_response = self.invoke_llm(prompt_input_structured_response_generator,stage_name='Structured response generator')
+            if structured_response_future is not None:
+                structured_response = structured_response_future.result()
+            else:
+                structured_response = self.invoke_structured_llm(prompt_input_structured_response_generator,stage_name='Structured response generator')
             structured_response = self.storage_db(structured_response)
+            if answer_cache_vector is not None and structured_response and structured_response.get('sqlCode'):
+                answer_cache.store(
+                    self.dataSource,
+                    answer_cache_vector,
+                    answer_cache_query,
+                    self.streamed_response,
+                    {field:structured_response[field] for field in FinalResponseModel.__fields__},
+                    catalog_version=answer_cache_version
+                    )
             log_str = f"Session Id {self.sessionId} Datasource {self.dataSource} Structured Response generated successfuly"
-            print(log_str)
-            logger.info(log_str)
-            print("Completed")
-            print(structured_response)
+            self.logger.info(log_str)
+            self.logger.payload('Structured response',structured_response)
             if structured_response:
                 yield json.dumps(structured_response)
         
         except Exception as e:
-            print(traceback.format_exc())
+            self.logger.error(traceback.format_exc())
             log_str = f"Session ID  {self.sessionId} Datasource {self.dataSource} Error occurred while generating assistant response: {str(e)}"
-            print(log_str)
-            logger.error(log_str)
+            self.logger.error(log_str)
 
             # Check for rate-limit in error text
             if '429' in str(e) or 'RateLimitReached' in str(e):
@@ -657,16 +902,58 @@ class Main():
             self.streamed_response+=user_message
             self.storage_db('')
             yield user_message
+        finally:
+            self.end_request_span()
+
+    def answer_cache_query(self):
+        """
+        Rephrased questions as plain text for the answer cache, the list repr would quote every question
+        """
+        if isinstance(self.rephrased_query,(list,tuple)):
+            return " ".join(str(query) for query in self.rephrased_query)
+        return str(self.rephrased_query)
+
+    def datasource_instructions(self):
+        """
+        Datasource specific rephraser, column retriever and query generator instructions plus followup suggestions
+        """
+        return DATASOURCE_INSTRUCTIONS.get(self.dataSource.lower(),(None,None,None,None))
+
+    async def astart_agent(self):
+        """
+        Async entry point by thread offload: the start_agent pipeline is stepped on pipeline_executor threads,
+        its LLM, Search and Databricks calls stay blocking and hold the thread, the event loop only hands chunks to the client
+        """
+        loop = asyncio.get_running_loop()
+        stream = self.start_agent()
+        step = None
+        try:
+            while True:
+                # Each step runs in a copy of the caller's context (log_context of the request)
+                step = loop.run_in_executor(pipeline_executor,contextvars.copy_context().run,next,stream,STREAM_END)
+                chunk = await asyncio.shield(step)
+                if chunk is STREAM_END:
+                    break
+                yield chunk
+        finally:
+            # A cancelled await leaves next() running on its thread, the generator can only be closed once it returns
+            if step is not None and not step.done():
+                await asyncio.wait([step])
+            await loop.run_in_executor(pipeline_executor,stream.close)
 
 '''
 Metadata extractor
 ''''''
 
 class Metadata():
+    """
+    Catalog snapshot of a datasource, queried without the query result cache so a refresh sees schema changes
+    """
     def __init__(self,datasource):
         self.datasource = datasource
         self.tables=[]
         self.datasource_description=""
+        self.logger = get_request_logger(datasource=datasource)
     
 
     def get_merative_table_data(self,table_name, description, db_schema):
@@ -675,8 +962,8 @@ class Metadata():
             table_query = f"DESCRIBE {table_path}"
             sql_query = f"SELECT * FROM {table_path} LIMIT 5"
 
-            table_metadata = sql_query_executor(table_query)
-            records = sql_query_executor(sql_query)
+            table_metadata = execute_sql(table_query)
+            records = execute_sql(sql_query)
 
             return {
                 "tableName": table_name,
@@ -686,7 +973,7 @@ class Metadata():
             }
         
         except Exception as e:
-            print(f"Error processing {table_name}: {e}")
+            self.logger.error(f"Error processing {table_name}: {e}")
             return None
 
     def fetch_info(self):
@@ -714,10 +1001,10 @@ class Metadata():
                 
                 table_query = f"DESCRIBE {settings.db_schema}.sem_survey.{table_name}"
                 sql_query = f"SELECT DISTINCT * from {settings.db_schema}.sem_survey.{table_name}  {selected_variables[table_name]} {filter_query[table_name]} LIMIT 5 "
-                table_metadata = sql_query_executor(table_query)
-                records = sql_query_executor(sql_query)
+                table_metadata = execute_sql(table_query)
+                records = execute_sql(sql_query)
 
-                print(table_metadata)
+                self.logger.payload('Table metadata',table_metadata)
                 try:
                     self.tables.append(
                         {"tableName": table_name,
@@ -744,10 +1031,10 @@ class Metadata():
 
                 table_query = f"DESCRIBE {settings.db_schema}.sem_sohea.{table_name}"
                 sql_query = f"SELECT DISTINCT * from {settings.db_schema}.sem_sohea.{table_name} LIMIT 5 "
-                table_metadata = sql_query_executor(table_query)
-                records = sql_query_executor(sql_query)
+                table_metadata = execute_sql(table_query)
+                records = execute_sql(sql_query)
 
-                print(table_metadata)
+                self.logger.payload('Table metadata',table_metadata)
                 try:
                     self.tables.append(
                         {"tableName": table_name,
@@ -772,10 +1059,10 @@ class Metadata():
                 
                 table_query = f"DESCRIBE {settings.db_schema}.sem_survey.{table_name}"
                 sql_query = f"SELECT DISTINCT * from {settings.db_schema}.sem_survey.{table_name} LIMIT 5 "
-                table_metadata = sql_query_executor(table_query)
-                records = sql_query_executor(sql_query)
+                table_metadata = execute_sql(table_query)
+                records = execute_sql(sql_query)
 
-                print(table_metadata)
+                self.logger.payload('Table metadata',table_metadata)
                 try:
                     self.tables.append(
                         {"tableName":table_name,
@@ -786,7 +1073,7 @@ class Metadata():
                     )
                 except:pass
         
-        if self.dataSource.lower()=='merative':
+        if self.datasource.lower()=='merative':
              self.datasource_description = (
                 "The 'merative' schema houses essential data related to dental and medical services, including patient demographics, provider information, "
                 "treatment details, and financial breakdowns. This schema plays a crucial role in tracking patient encounters, claims processing, and insurance enrollments "
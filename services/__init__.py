@@ -1,17 +1,107 @@
-from rag_agent import Main, Metadata
+from config import settings
+from services.common.metadata_cache import MetadataSnapshotCache
+from services.common.answer_cache import answer_cache
+from services.common.query_cache import query_cache
+from services.common.utils import logger, message_client, session_client
+from services.common.search_clients import search_client_registry
+import threading
+import asyncio
+import time
+
+# rag_agent (langchain, prompt templates, LLM connectors) is imported on the first chat or by warm_up
+
+def chatbot_agent(sessionId, userPrompt, dataSource, userId):
+    from rag_agent import Main
+    return Main(sessionId, userPrompt, dataSource, userId)
 
 def chatbot(sessionId, userPrompt, dataSource, userId):
-    agent = Main(sessionId, userPrompt, dataSource, userId)
-    return agent.start_agent()
+    return chatbot_agent(sessionId, userPrompt, dataSource, userId).start_agent()
+
+async def achatbot(sessionId, userPrompt, dataSource, userId):
+    """
+    Async endpoint stream, the first import of rag_agent and the construction of Main run off the event loop
+    """
+    agent = await asyncio.to_thread(chatbot_agent, sessionId, userPrompt, dataSource, userId)
+    return agent.astart_agent()
+
+def load_metadata(datasource):
+    """
+    Builds a fresh metadata snapshot from Databricks
+    """
+    from rag_agent import Metadata
+    return Metadata(datasource).fetch_info()
+
+def invalidate_caches(datasource):
+    """
+    Catalog of a datasource changed, cached answers and SQL results may be stale
+    """
+    answer_cache.invalidate(datasource)
+    query_cache.invalidate(datasource)
+
+# Metadata snapshots served by /api/metadata/v1, catalog changes invalidate cached answers and query results
+metadata_cache = MetadataSnapshotCache(
+    load_metadata,
+    settings.metadata_datasources,
+    settings.metadata_cache_ttl,
+    settings.metadata_refresh_interval,
+    on_change=invalidate_caches,
+    empty_ttl=settings.metadata_empty_ttl
+)
 
 def metadata_extraction(datasource):
     """
-    Wrapper for Metadata class in rag_agent.py
+    Wrapper for Metadata class in rag_agent.py, served from the in-memory snapshot cache
     """
     try:
-        meta = Metadata(datasource)
-        meta.process()
-        return meta.tables
+        return metadata_cache.get(datasource)['tables']
     except Exception as e:
-        print(f"Error in metadata_extraction: {e}")
+        logger.error(f"Error in metadata_extraction: {e}")
         return []
+
+def warm_up():
+    """
+    Imports the agent pipeline and connects backend clients ahead of the first chat
+    """
+    def import_pipeline():
+        import rag_agent
+
+    def connect_embeddings():
+        from services.agent_tools import embeddings_connector
+        embeddings_connector.resolve()
+
+    def load_intent_exemplars():
+        # Exemplar embeddings of the intent pre-classifier, only when it is enabled
+        if settings.intent_prefilter_mode != "off":
+            from rag_agent import intent_pre_classifier
+            intent_pre_classifier.ensure_loaded()
+
+    def connect_cosmos():
+        message_client.connect()
+        session_client.connect()
+
+    steps = {
+        "agent pipeline": import_pipeline,
+        "embeddings": connect_embeddings,
+        "intent exemplars": load_intent_exemplars,
+        "cosmos": connect_cosmos,
+        "search clients": search_client_registry.warm_up,
+    }
+    start_time = time.perf_counter()
+    for step, action in steps.items():
+        try:
+            action()
+        except Exception as e:
+            logger.error(f"Warm-up step {step} failed: {e}")
+    logger.info("Warm-up finished in %.2fs", time.perf_counter() - start_time)
+
+def start_warm_up(mode=None):
+    """
+    Runs warm_up according to STARTUP_WARM_UP: off, background (daemon thread) or blocking
+    """
+    mode = mode or settings.startup_warm_up
+    if mode == "blocking":
+        warm_up()
+    elif mode == "background":
+        threading.Thread(target=warm_up, name="startup-warmup", daemon=True).start()
+    elif mode != "off":
+        logger.error(f"Unknown STARTUP_WARM_UP {mode}, warm-up skipped")
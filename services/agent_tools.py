@@ -1,46 +1,99 @@
-from databricks import sql
 from typing import Annotated
-from services.common.utils import read_sohea_mapping_file
-from config import settings, medical_codes, tooth_codes
+from services.common.utils import read_sohea_mapping_file, logger
+from app_logger import truncate
+from services.common.databricks_pool import databricks_pool
+from services.common.query_cache import query_cache
+from services.common.sql_results import inject_limit, fetch_limited, summarize_result
+from services.common.tracing import stage_span
+from services.common.metrics import record_databricks_query, component_stats, SEARCH_LATENCY
+from services.common.search_clients import search_client_registry
+from services.common.embedding_cache import EmbeddingCache, EmbeddingBatcher, CachedEmbeddings
+from services.common.lazy import LazyObject
+from config import settings
+import config
 from langchain.agents import tool
-from azure.search.documents import SearchClient
-from azure.core.credentials import AzureKeyCredential
 from azure.search.documents.models import VectorizedQuery
 from langchain_openai import AzureOpenAIEmbeddings
+from concurrent.futures import ThreadPoolExecutor
 import httpx
+import contextvars
 import json
+import time
 
 http_client = httpx.Client(verify=False)
 
-# Langchain azure openai embeddings
-embeddings_connector = AzureOpenAIEmbeddings(
+# Langchain azure openai embeddings, built on the first embedding request
+embeddings_connector = LazyObject(lambda: AzureOpenAIEmbeddings(
     azure_endpoint=settings.LLM_Config['embedding']['endpoint'],
     api_key=settings.LLM_Config['embedding']['subscription_key'],
     api_version=settings.LLM_Config['embedding']['api_version'],
     model=settings.LLM_Config['embedding']['model_name'],
     http_client=httpx.Client(verify=False)
+))
+
+# Cached, batched front-end for query embeddings
+cached_embeddings = CachedEmbeddings(
+    embeddings_connector,
+    settings.LLM_Config['embedding']['model_name'],
+    EmbeddingCache(settings.embedding_cache_size, settings.embedding_cache_path),
+    EmbeddingBatcher(embeddings_connector, settings.embedding_batch_size, settings.embedding_batch_wait_ms)
 )
+component_stats.register("embedding_cache", cached_embeddings.cache.stats)
 
-# Method to execute generated sql query
-def sql_query_executor(sql_query):
+# Method to execute generated sql query on a pooled connection
+def execute_sql(sql_query):
+    start_time = time.perf_counter()
     try:
-        databricks_connection = sql.connect(
-            server_hostname=settings.dbhostname,
-            http_path=settings.sqlurl,
-            access_token=settings.dbaccesstoken,
-            verify=False
-        )
-        cursor = databricks_connection.cursor()
-        try:
-            cursor.execute(sql_query)
-            results = cursor.fetchall()
-            return results
-        finally:
-            cursor.close()
-            databricks_connection.close()
+        with databricks_pool.connection() as databricks_connection:
+            cursor = databricks_connection.cursor()
+            try:
+                cursor.execute(sql_query)
+                results = cursor.fetchall()
+                record_databricks_query("raw", time.perf_counter() - start_time, len(results))
+                return results
+            finally:
+                cursor.close()
     except Exception as e:
+        record_databricks_query("raw", time.perf_counter() - start_time, failed=True)
         return f"Failed Error: {str(e)}"
 
+# Method to execute sql query, repeated read-only queries are served from the result cache
+def sql_query_executor(sql_query, datasource=None):
+    if not settings.query_cache_enabled:
+        return execute_sql(sql_query)
+    return query_cache.execute(settings.db_schema, sql_query, execute_sql, datasource=datasource)
+
+# Method to execute agent generated sql with row/byte caps, returns a compact columnar summary
+def execute_agent_sql(sql_query):
+    if settings.sql_result_inject_limit:
+        sql_query = inject_limit(sql_query, settings.sql_result_max_rows)
+    start_time = time.perf_counter()
+    try:
+        with databricks_pool.connection() as databricks_connection:
+            cursor = databricks_connection.cursor()
+            try:
+                cursor.execute(sql_query)
+                rows, truncated = fetch_limited(
+                    cursor,
+                    settings.sql_result_max_rows,
+                    settings.sql_result_max_bytes,
+                    settings.sql_result_fetch_size
+                )
+                columns = [column[0] for column in cursor.description or []]
+                record_databricks_query("agent", time.perf_counter() - start_time, len(rows))
+                return summarize_result(columns, rows, truncated)
+            finally:
+                cursor.close()
+    except Exception as e:
+        record_databricks_query("agent", time.perf_counter() - start_time, failed=True)
+        return f"Failed Error: {str(e)}"
+
+def agent_sql_executor(sql_query):
+    if not settings.query_cache_enabled:
+        return execute_agent_sql(sql_query)
+    # Shaped results are cached apart from the raw rows of sql_query_executor
+    return query_cache.execute(f"{settings.db_schema}:agent", sql_query, execute_agent_sql)
+
 @tool
 def fetch_record(sql_query: Annotated[str, "SQL Query to fetch records from the database."]):
     """
@@ -50,23 +103,28 @@ def fetch_record(sql_query: Annotated[str, "SQL Query to fetch records from the
         sql_query (str): The SQL query string to execute.
 
     Returns:
-        list: A list of rows fetched from the database or an error message string.
+        dict: Column names, row count, the fetched rows (capped) and a truncation flag, or an error message string.
     """
-    return sql_query_executor(sql_query)
+    with stage_span('Tool fetch_record', **{"tool.name": "fetch_record"}) as span:
+        result = agent_sql_executor(sql_query)
+        if isinstance(result, dict):
+            span.set_attributes({"sql.row_count": result["row_count"], "sql.truncated": result["truncated"]})
+        return result
 
 def catalog_query_exec(table_name):
     query = f"DESCRIBE {table_name}"
-    return sql_query_executor(query)
+    with stage_span('Catalog Describe', **{"db.table": table_name}):
+        return sql_query_executor(query)
 
 # Method to execute AI Search query
 def run_query(index_name, reqbody, select_fields_, top_=50):
-    search_client = SearchClient(
-        endpoint=settings.search_endpoint,
-        index_name=index_name,
-        credential=AzureKeyCredential(settings.search_key)
-    )
+    with stage_span('Tool AI Search', **{"search.index": index_name, "datasource": reqbody.get('datasource')}):
+        return search_index(index_name, reqbody, select_fields_, top_)
+
+def search_index(index_name, reqbody, select_fields_, top_=50):
+    search_client = search_client_registry.get(index_name)
     
-    embedded_query = embeddings_connector.embed_query(reqbody['query'])
+    embedded_query = cached_embeddings.embed_query(reqbody['query'])
 
     # Vectorized query
     vector_query = VectorizedQuery(
@@ -100,20 +158,23 @@ def run_query(index_name, reqbody, select_fields_, top_=50):
         if 'yearnumber' in reqbody:
             combined_filter += f" and yearnumber eq '{reqbody['yearnumber']}'"
 
-        print(f"combined_filter", combined_filter)
+        logger.debug("combined_filter %s", combined_filter)
 
-        docs = search_client.search(
-            search_text=reqbody['query'],
-            vector_queries=[vector_query],
-            top=top_,
-            select=select_fields_,
-            semantic_configuration_name="sem-config",
-            query_type="semantic",
-            filter=combined_filter
-        )
+        # Search latency covers the request and paging through its results, not the query embedding
+        with SEARCH_LATENCY.labels(index_name).time():
+            docs = search_client.search(
+                search_text=reqbody['query'],
+                vector_queries=[vector_query],
+                top=top_,
+                select=select_fields_,
+                semantic_configuration_name="sem-config",
+                query_type="semantic",
+                filter=combined_filter
+            )
+            docs = list(docs)
 
         for doc in docs:
-            print('Search Score', doc.get('@search.score'))
+            logger.debug("Search Score %s", doc.get('@search.score'))
             row = {}
             for field in select_fields_:
                 if field == 'id':
@@ -166,12 +227,19 @@ def column_metadata_extractor(
             index_name = settings.research_search_section_index
             doc_sections = []
             
-            for row in formatted_context:
-                reqbody['filenames'] = [row['filename']]
-                print(reqbody)
-                formatted_context_sections = run_query(index_name, reqbody, select_fields, top_=top_sections)
-                print(formatted_context_sections)
-                doc_sections.extend(formatted_context_sections)
+            # One section lookup per document, fanned out concurrently; map() keeps document order.
+            # Each lookup runs in a copy of this context so its span stays a child of the current tool span
+            section_reqbodies = [{**reqbody, 'filenames': [row['filename']]} for row in formatted_context]
+            if section_reqbodies:
+                with ThreadPoolExecutor(max_workers=min(settings.research_section_workers, len(section_reqbodies))) as executor:
+                    section_results = executor.map(
+                        lambda section_reqbody, context: context.run(run_query, index_name, section_reqbody, select_fields, top_=top_sections),
+                        section_reqbodies,
+                        [contextvars.copy_context() for _ in section_reqbodies]
+                    )
+                    for formatted_context_sections in section_results:
+                        logger.debug("Research sections %s", truncate(formatted_context_sections, settings.log_payload_max_chars))
+                        doc_sections.extend(formatted_context_sections)
             
             return doc_sections
 
@@ -189,7 +257,9 @@ def column_metadata_extractor(
 
         if 'json' in reqbody:
             if reqbody['datasource'].lower() in ['dqddma', 'dq-ddma']:
-                return {key: tooth_codes.get("Tooth Codes", {}).get(key, "") for key in reqbody['json_keys'] if key in tooth_codes.get("Tooth Codes", {})}
+                tooth_codes = config.tooth_codes.get("Tooth Codes", {})
+                return {key: tooth_codes.get(key, "") for key in reqbody['json_keys'] if key in tooth_codes}
+            medical_codes = config.medical_codes
             return {key: medical_codes[key] for key in reqbody['json_keys'] if key in medical_codes}
 
         if 'selected_table_name' in reqbody:
@@ -199,7 +269,7 @@ def column_metadata_extractor(
                 f'{settings.db_schema}.reference.ref_cpt_code_lookup'
             ]):
                 index_name_ = settings.medical_code_index
-                print('..... INDEXNAME', index_name_)
+                logger.debug("..... INDEXNAME %s", index_name_)
                 select_fields = ["id", "colname", "value", "targettable", "description", "sourcetable", "query_mode"]
                 formatted_context = run_query(index_name_, reqbody, select_fields, top_=100)
                 return json.dumps(formatted_context)
@@ -218,7 +288,8 @@ def sohea_mapping_file_reader(reqbody):
         reqbody = json.loads(reqbody)
     
     filename = reqbody.get("filename")
-    return read_sohea_mapping_file(filename)
+    with stage_span('Tool sohea_mapping_file_reader', **{"tool.name": "sohea_mapping_file_reader", "file.name": filename}):
+        return read_sohea_mapping_file(filename)
 
 # Initialized Agent Tools
 tools = [fetch_record]
@@ -0,0 +1,154 @@
+from config import settings
+import numpy as np
+import threading
+import time
+import re
+
+US_STATES = {
+    "alabama", "alaska", "arizona", "arkansas", "california", "colorado", "connecticut", "delaware", "florida", "georgia",
+    "hawaii", "idaho", "illinois", "indiana", "iowa", "kansas", "kentucky", "louisiana", "maine", "maryland",
+    "massachusetts", "michigan", "minnesota", "mississippi", "missouri", "montana", "nebraska", "nevada", "new hampshire",
+    "new jersey", "new mexico", "new york", "north carolina", "north dakota", "ohio", "oklahoma", "oregon", "pennsylvania",
+    "rhode island", "south carolina", "south dakota", "tennessee", "texas", "utah", "vermont", "virginia", "washington",
+    "west virginia", "wisconsin", "wyoming", "district of columbia", "puerto rico"
+}
+US_STATE_CODES = {
+    "AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "FL", "GA", "HI", "ID", "IL", "IN", "IA", "KS", "KY", "LA", "ME", "MD",
+    "MA", "MI", "MN", "MS", "MO", "MT", "NE", "NV", "NH", "NJ", "NM", "NY", "NC", "ND", "OH", "OK", "OR", "PA", "RI", "SC",
+    "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV", "WI", "WY", "DC", "PR"
+}
+STATE_PATTERN = re.compile(r"\b(" + "|".join(sorted(US_STATES, key=len, reverse=True)) + r")\b", re.IGNORECASE)
+STATE_CODE_PATTERN = re.compile(r"\b[A-Z]{2}\b")
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*")
+# Quotes are not part of a word, apostrophes (children's, states') do not open a literal
+QUOTED_PATTERN = re.compile(r"(?<!\w)[\"'`]([^\"'`]+)[\"'`](?!\w)")
+COUNTY_PATTERN = re.compile(r"((?:[\w.'-]+\s+){1,3})(county|counties|parish|borough)\b", re.IGNORECASE)
+
+COUNTY_LEADING_WORDS = {"in", "for", "of", "the", "and", "or", "by", "per", "from", "at", "to", "vs", "versus", "each", "which", "what"}
+
+def county_name(words):
+    words = words.lower().split()
+    while words and words[0] in COUNTY_LEADING_WORDS:
+        words = words[1:]
+    return " ".join(words)
+
+def query_literals(query):
+    """
+    Literals that must match exactly for two questions to share an answer: numbers and years,
+    quoted strings, state names/codes and county names. Near-identical embeddings do not tell 2021 from 2022.
+    """
+    query = str(query)
+    literals = {("number", number.replace(",", "")) for number in NUMBER_PATTERN.findall(query)}
+    literals |= {("quoted", quoted.strip().lower()) for quoted in QUOTED_PATTERN.findall(query)}
+    literals |= {("state", state.lower()) for state in STATE_PATTERN.findall(query)}
+    literals |= {("state", code) for code in STATE_CODE_PATTERN.findall(query) if code in US_STATE_CODES}
+    literals |= {("county", county_name(name)) for name, _ in COUNTY_PATTERN.findall(query) if county_name(name)}
+    return frozenset(literals)
+
+# Semantic cache of final answers keyed by (datasource, embedding of rephrased query)
+class SemanticAnswerCache:
+    def __init__(self, similarity_threshold, ttl, max_entries):
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._vectors = {}
+        self._catalog_versions = {}
+        # Bumped by a global invalidation, answers generated under an older generation are never stored
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.metrics = {"hits": 0, "misses": 0, "literal_mismatches": 0, "stores": 0, "invalidations": 0}
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _purge_expired(self, datasource):
+        # Caller must hold the lock
+        entries = self._entries.get(datasource, [])
+        now = time.time()
+        keep = [i for i, entry in enumerate(entries) if now - entry["created_at"] <= self.ttl]
+        if len(keep) != len(entries):
+            self._entries[datasource] = [entries[i] for i in keep]
+            self._vectors[datasource] = self._vectors[datasource][keep] if keep else None
+
+    def catalog_version(self, datasource):
+        with self._lock:
+            return (self._generation, self._catalog_versions.get(datasource.lower(), 0))
+
+    def lookup(self, datasource, vector, query):
+        """Most similar cached answer above the threshold whose query has exactly the same literals."""
+        datasource = datasource.lower()
+        literals = query_literals(query)
+        with self._lock:
+            self._purge_expired(datasource)
+            vectors = self._vectors.get(datasource)
+            if vectors is None or not len(vectors):
+                self.metrics["misses"] += 1
+                return None
+            similarities = vectors @ self._normalize(vector)
+            candidates = [
+                i for i, entry in enumerate(self._entries[datasource])
+                if similarities[i] >= self.similarity_threshold and entry["literals"] == literals
+            ]
+            if not candidates:
+                self.metrics["misses"] += 1
+                if any(similarities >= self.similarity_threshold):
+                    self.metrics["literal_mismatches"] += 1
+                return None
+            best = max(candidates, key=lambda i: similarities[i])
+            self.metrics["hits"] += 1
+            entry = self._entries[datasource][best]
+            return {**entry, "similarity": float(similarities[best])}
+
+    def store(self, datasource, vector, query, streamed_response, structured_response, catalog_version=None):
+        datasource = datasource.lower()
+        with self._lock:
+            if catalog_version is not None and catalog_version != (self._generation, self._catalog_versions.get(datasource, 0)):
+                # Catalog changed while this answer was being generated
+                return
+            self._purge_expired(datasource)
+            entries = self._entries.setdefault(datasource, [])
+            vector = self._normalize(vector)[np.newaxis, :]
+            vectors = self._vectors.get(datasource)
+            entries.append({
+                "query": query,
+                "literals": query_literals(query),
+                "streamed_response": streamed_response,
+                "structured_response": structured_response,
+                "created_at": time.time()
+            })
+            vectors = vector if vectors is None else np.vstack([vectors, vector])
+            if len(entries) > self.max_entries:
+                # Oldest entries first out
+                overflow = len(entries) - self.max_entries
+                del entries[:overflow]
+                vectors = vectors[overflow:]
+            self._vectors[datasource] = vectors
+            self.metrics["stores"] += 1
+
+    def invalidate(self, datasource=None):
+        """Drop cached answers when the underlying catalog of a datasource (or every datasource) changes."""
+        with self._lock:
+            if datasource:
+                name = datasource.lower()
+                self._entries.pop(name, None)
+                self._vectors.pop(name, None)
+                self._catalog_versions[name] = self._catalog_versions.get(name, 0) + 1
+            else:
+                self._entries.clear()
+                self._vectors.clear()
+                self._generation += 1
+            self.metrics["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self.metrics, "entries": {name: len(entries) for name, entries in self._entries.items()}}
+
+answer_cache = SemanticAnswerCache(
+    settings.answer_cache_similarity_threshold,
+    settings.answer_cache_ttl,
+    settings.answer_cache_max_entries
+)
@@ -2,21 +2,158 @@ import jwt
 import requests
 import os
 import logging
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from jwt import ExpiredSignatureError, InvalidTokenError
 from config import settings
 from services.common.utils import source_specific_user_prompts_guide_book
 
+# Application logger, handlers and level are configured by app_logger.setup_logging
+logger = logging.getLogger("AI DataExplorer")
+
 def getPublicKeys(TENANT_ID):
     try:
-        url = f"https://login.microsoftonline.com/{TENANT_ID}/discovery/v2.0/keys"
-        response = requests.get(url, timeout=None)
+        url = settings.jwks_url.format(tenant_id=TENANT_ID)
+        response = requests.get(url, timeout=settings.jwks_fetch_timeout)
+        response.raise_for_status()
         return response.json()["keys"]
     except Exception as ex:
-        logging.info(
+        logger.info(
             f"Some error occurred while fetching Public Keys. Error Details: {str(ex)}"
         )
         raise
 
+class JwksCache:
+    """
+    Tenant signing keys cached by kid.
+    Stale key sets keep serving while a background thread refreshes them,
+    an unknown kid triggers a synchronous refresh (rate limited) to pick up key rotation.
+    """
+    def __init__(self, ttl, min_refresh_interval):
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._keys = {}
+        self._fetched_at = {}
+        # Time of the last refresh attempt, successful or not, so a failing endpoint is not hammered
+        self._attempted_at = {}
+        self._lock = threading.Lock()
+        # Serializes synchronous refreshes, concurrent requests for a new kid wait for the one fetch
+        self._sync_refresh_lock = threading.Lock()
+        self._refreshing = set()
+
+    def _claim_refresh(self, tenant_id):
+        # Caller must hold the lock, at most one refresh per tenant per min_refresh_interval
+        now = time.monotonic()
+        if tenant_id in self._refreshing or now - self._attempted_at.get(tenant_id, float("-inf")) <= self.min_refresh_interval:
+            return False
+        self._refreshing.add(tenant_id)
+        self._attempted_at[tenant_id] = now
+        return True
+
+    def _refresh(self, tenant_id):
+        try:
+            public_keys = getPublicKeys(tenant_id)
+            keys = {}
+            for key in public_keys:
+                # Only RSA signing keys are usable here, other entries are skipped instead of failing the set
+                if key.get("kty") != "RSA" or not all(key.get(field) for field in ("kid", "n", "e")):
+                    continue
+                rsa_key = {
+                    "kty": key["kty"],
+                    "kid": key["kid"],
+                    "n": key["n"],
+                    "e": key["e"],
+                }
+                try:
+                    keys[key["kid"]] = jwt.algorithms.RSAAlgorithm.from_jwk(rsa_key)
+                except Exception as ex:
+                    logger.info(f"Skipping unusable JWKS key {key['kid']}. Error Details: {str(ex)}")
+            with self._lock:
+                self._keys[tenant_id] = keys
+                self._fetched_at[tenant_id] = time.monotonic()
+        finally:
+            with self._lock:
+                self._refreshing.discard(tenant_id)
+
+    def _background_refresh(self, tenant_id):
+        try:
+            self._refresh(tenant_id)
+        except Exception as ex:
+            logger.info(f"Background JWKS refresh failed. Error Details: {str(ex)}")
+
+    def get_key(self, tenant_id, kid):
+        with self._lock:
+            keys = self._keys.get(tenant_id, {})
+            age = time.monotonic() - self._fetched_at.get(tenant_id, float("-inf"))
+            start_background = bool(keys) and age > self.ttl and self._claim_refresh(tenant_id)
+
+        if start_background:
+            threading.Thread(target=self._background_refresh, args=(tenant_id,), daemon=True).start()
+
+        if kid in keys:
+            return keys[kid]
+
+        # Unknown kid: keys may have rotated, refresh unless one was attempted recently
+        with self._sync_refresh_lock:
+            with self._lock:
+                key = self._keys.get(tenant_id, {}).get(kid)
+                refresh = key is None and self._claim_refresh(tenant_id)
+            if refresh:
+                self._refresh(tenant_id)
+                with self._lock:
+                    key = self._keys.get(tenant_id, {}).get(kid)
+        return key
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+            self._fetched_at.clear()
+            self._attempted_at.clear()
+
+class VerifiedTokenCache:
+    """LRU of already verified tokens keyed by token hash, entries expire with the token's exp claim."""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _token_hash(token):
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token):
+        token_hash = self._token_hash(token)
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is None:
+                return None
+            decoded_token, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[token_hash]
+                return None
+            self._entries.move_to_end(token_hash)
+            return decoded_token
+
+    def put(self, token, decoded_token):
+        expires_at = decoded_token.get("exp")
+        if not expires_at:
+            return
+        token_hash = self._token_hash(token)
+        with self._lock:
+            self._entries[token_hash] = (decoded_token, float(expires_at))
+            self._entries.move_to_end(token_hash)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+jwks_cache = JwksCache(settings.jwks_cache_ttl, settings.jwks_min_refresh_interval)
+verified_token_cache = VerifiedTokenCache(settings.token_cache_size)
+
 def getUserDetail(decoded_token: dict, isresearch_user: str):
     try:
         user_details = {"email": None, "type": None, "id": None, "name": None}
@@ -44,7 +181,7 @@ def getUserDetail(decoded_token: dict, isresearch_user: str):
         
         return user_details
     except Exception as ex:
-        logging.info(
+        logger.info(
             f"Some error occurred while extracting user details. Error Details: {str(ex)}"
         )
         raise
@@ -92,7 +229,7 @@ def getDatasourceDetail(decoded_token: dict, isresearch_user: str):
         }
         
         datasources_backend = []
-        print('......', isresearch_user)
+        logger.debug('Datasource access requested, isresearch header %s', isresearch_user)
         
         if isresearch_user == 'false' or isresearch_user == None:
             survey_user, sohea_user, merative_user, hcn_user, dqddma_user = get_user_roles(user_groups)
@@ -147,13 +284,17 @@ def getDatasourceDetail(decoded_token: dict, isresearch_user: str):
         return user_info, datasources_backend
         
     except Exception as ex:
-        logging.info(
+        logger.info(
             f"Some error occurred while extracting user details. Error Details: {str(ex)}"
         )
         raise
 
 def validateToken(id_token):
     try:
+        cached_token = verified_token_cache.get(id_token)
+        if cached_token is not None:
+            return cached_token
+
         CLIENT_ID = os.environ["AD_CLIENT_ID"]
         TENANT_ID = os.environ["AD_TENANT_ID"]
         
@@ -162,33 +303,19 @@ def validateToken(id_token):
             raise Exception("Invalid Token header")
             
         key_id = unverified_header["kid"]
-        public_keys = getPublicKeys(TENANT_ID)
-        public_key = None
-        
-        for key in public_keys:
-            if key["kid"] == key_id:
-                public_key = key
-                break
+        public_key_pem = jwks_cache.get_key(TENANT_ID, key_id)
                 
-        if public_key is None:
+        if public_key_pem is None:
             raise Exception("Public key not found")
-            
-        rsa_key = {
-            "kty": public_key["kty"],
-            "kid": public_key["kid"],
-            "n": public_key["n"],
-            "e": public_key["e"],
-        }
-        
-        public_key_pem = jwt.algorithms.RSAAlgorithm.from_jwk(rsa_key)
         
         decoded_token = jwt.decode(
             id_token,
             public_key_pem,
             algorithms=["RS256"],
             audience=CLIENT_ID,
-            issuer=f"https://login.microsoftonline.com/{TENANT_ID}/v2.0",
+            issuer=settings.token_issuer.format(tenant_id=TENANT_ID),
         )
+        verified_token_cache.put(id_token, decoded_token)
         
         return decoded_token
         
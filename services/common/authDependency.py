@@ -1,6 +1,6 @@
-from fastapi import Header, HTTPException, Depends
-from services.common.auth import validateToken, getDatasourceDetail, getUserDetail
-import logging
+from fastapi import Header, HTTPException
+from services.common.auth import validateToken, getDatasourceDetail
+from services.common.utils import logger
 
 async def Authorization(authorization: str = Header(None)):
     if not authorization:
@@ -30,6 +30,5 @@ def DatasourceAuthorization(authorization, isresearch):
 
         return user_info, datasources_backend
     except Exception as e:
-        # Log error if needed
-        print(f"Auth Decision Error: {e}")
+        logger.debug("Auth decision error: %s", str(e))
         raise HTTPException(status_code=401, detail="Authentication failed or invalid token")
@@ -0,0 +1,180 @@
+from contextlib import contextmanager
+from collections import deque
+from config import settings
+import threading
+import logging
+import time
+
+# Application logger
+logger = logging.getLogger("AI DataExplorer")
+
+# Pooled Databricks connection wrapper
+class PooledConnection:
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+        self.needs_check = False
+
+    def age(self):
+        return time.monotonic() - self.created_at
+
+    def idle_time(self):
+        return time.monotonic() - self.last_used_at
+
+# Bounded, thread-safe Databricks SQL connection pool
+class DatabricksConnectionPool:
+    def __init__(self, max_size, checkout_timeout, idle_timeout, max_lifetime, health_check_interval):
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+
+        self._idle = deque()
+        self._in_use = 0
+        self._lock = threading.Condition()
+        self.metrics = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_timeouts": 0,
+            "creations": 0,
+            "closed_idle": 0,
+            "closed_expired": 0,
+            "closed_broken": 0,
+            "health_check_failures": 0
+        }
+
+    def _connect(self):
+        # Imported on the first checkout, the connector is heavy and unused until a query runs
+        from databricks import sql
+        connection = sql.connect(
+            server_hostname=settings.dbhostname,
+            http_path=settings.sqlurl,
+            access_token=settings.dbaccesstoken,
+            verify=False
+        )
+        with self._lock:
+            self.metrics["creations"] += 1
+        return PooledConnection(connection)
+
+    def _close(self, pooled, reason):
+        with self._lock:
+            self.metrics[f"closed_{reason}"] += 1
+        try:
+            pooled.connection.close()
+        except Exception as e:
+            logger.info("Error while closing Databricks connection: %s", str(e))
+
+    def _is_healthy(self, pooled):
+        # Cheap liveness check first, round-trip only for connections idle long enough
+        if not getattr(pooled.connection, "open", True):
+            return False
+        if not pooled.needs_check and pooled.idle_time() < self.health_check_interval:
+            return True
+        try:
+            cursor = pooled.connection.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            pooled.needs_check = False
+            return True
+        except Exception:
+            with self._lock:
+                self.metrics["health_check_failures"] += 1
+            return False
+
+    def _evict_idle(self):
+        # Caller must hold the lock
+        stale = []
+        while self._idle and self._idle[0].idle_time() > self.idle_timeout:
+            stale.append(self._idle.popleft())
+        return stale
+
+    def acquire(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._lock:
+            stale = self._evict_idle()
+            waited = False
+            while not self._idle and self._in_use >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.metrics["wait_timeouts"] += 1
+                    raise TimeoutError(f"Timed out waiting for a Databricks connection after {self.checkout_timeout}s")
+                if not waited:
+                    self.metrics["waits"] += 1
+                    waited = True
+                self._lock.wait(remaining)
+            pooled = self._idle.pop() if self._idle else None
+            self._in_use += 1
+            self.metrics["checkouts"] += 1
+
+        for conn in stale:
+            self._close(conn, "idle")
+
+        try:
+            while pooled is not None:
+                if pooled.age() > self.max_lifetime:
+                    self._close(pooled, "expired")
+                elif not self._is_healthy(pooled):
+                    self._close(pooled, "broken")
+                else:
+                    return pooled
+                with self._lock:
+                    pooled = self._idle.pop() if self._idle else None
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._in_use -= 1
+                self._lock.notify()
+            raise
+
+    def release(self, pooled):
+        pooled.last_used_at = time.monotonic()
+        expired = pooled.age() > self.max_lifetime
+        with self._lock:
+            self._in_use -= 1
+            if not expired:
+                self._idle.append(pooled)
+            self._lock.notify()
+        if expired:
+            self._close(pooled, "expired")
+
+    @contextmanager
+    def connection(self):
+        pooled = self.acquire()
+        try:
+            yield pooled.connection
+        except Exception:
+            # Connection state is unknown after a failed statement, ping it before next reuse
+            pooled.needs_check = True
+            raise
+        finally:
+            self.release(pooled)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.metrics,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "max_size": self.max_size
+            }
+
+    def close_all(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for pooled in idle:
+            self._close(pooled, "idle")
+
+# Process-wide pool shared by sql_query_executor, catalog_query_exec and year validation
+databricks_pool = DatabricksConnectionPool(
+    max_size=settings.db_pool_size,
+    checkout_timeout=settings.db_pool_timeout,
+    idle_timeout=settings.db_pool_idle_timeout,
+    max_lifetime=settings.db_pool_max_lifetime,
+    health_check_interval=settings.db_pool_health_check_interval
+)
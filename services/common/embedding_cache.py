@@ -0,0 +1,149 @@
+from concurrent.futures import Future
+from collections import OrderedDict
+import unicodedata
+import threading
+import hashlib
+import logging
+import sqlite3
+import json
+import time
+import re
+
+# Application logger
+logger = logging.getLogger("AI DataExplorer")
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFC", str(text))
+    return re.sub(r"\s+", " ", text).strip()
+
+def embedding_key(model_name, text):
+    return hashlib.sha256(f"{model_name}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+# Content-addressed embedding cache (in-memory LRU with optional sqlite persistence)
+class EmbeddingCache:
+    def __init__(self, max_size, persist_path=None):
+        self.max_size = max_size
+        self.persist_path = persist_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {"hits": 0, "disk_hits": 0, "misses": 0}
+        self._db = None
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector TEXT NOT NULL)")
+            self._db.commit()
+
+    def _remember(self, key, vector):
+        # Caller must hold the lock
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.metrics["hits"] += 1
+                return vector
+            if self._db is not None:
+                row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row:
+                    vector = json.loads(row[0])
+                    self._remember(key, vector)
+                    self.metrics["disk_hits"] += 1
+                    return vector
+            self.metrics["misses"] += 1
+            return None
+
+    def put(self, key, vector):
+        with self._lock:
+            self._remember(key, vector)
+            if self._db is not None:
+                try:
+                    self._db.execute("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", (key, json.dumps(vector)))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.error("Failed to persist embedding: %s", str(e))
+
+    def stats(self):
+        with self._lock:
+            return {**self.metrics, "size": len(self._entries), "max_size": self.max_size}
+
+# Coalesces concurrent embed requests into one embed_documents call
+class EmbeddingBatcher:
+    def __init__(self, embeddings, max_batch_size, max_wait_ms):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending = OrderedDict()
+        self._lock = threading.Condition()
+        self._worker = None
+        self.metrics = {"requests": 0, "batches": 0, "coalesced": 0}
+
+    def _ensure_worker(self):
+        # Caller must hold the lock
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self._worker.start()
+
+    def submit(self, text):
+        text = normalize_text(text)
+        with self._lock:
+            self.metrics["requests"] += 1
+            future = self._pending.get(text)
+            if future is not None:
+                # Identical text already queued, share its result
+                self.metrics["coalesced"] += 1
+                return future
+            future = Future()
+            self._pending[text] = future
+            self._ensure_worker()
+            self._lock.notify()
+            return future
+
+    def _next_batch(self):
+        with self._lock:
+            while not self._pending:
+                self._lock.wait()
+            deadline = time.monotonic() + self.max_wait
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+            batch = []
+            while self._pending and len(batch) < self.max_batch_size:
+                batch.append(self._pending.popitem(last=False))
+            self.metrics["batches"] += 1
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            texts = [text for text, _ in batch]
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+# Cache + batching front-end used in place of embed_query
+class CachedEmbeddings:
+    def __init__(self, embeddings, model_name, cache, batcher):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
+        self.batcher = batcher
+
+    def embed_query(self, text):
+        key = embedding_key(self.model_name, text)
+        vector = self.cache.get(key)
+        if vector is not None:
+            return vector
+        vector = self.batcher.submit(text).result()
+        self.cache.put(key, vector)
+        return vector
@@ -0,0 +1,104 @@
+from collections import OrderedDict
+from config import settings
+import threading
+import tiktoken
+import logging
+
+# Application logger
+logger = logging.getLogger("AI DataExplorer")
+
+# Rough characters-per-token ratio used when a tiktoken encoding cannot be loaded
+APPROX_CHARS_PER_TOKEN = 4
+
+_encodings = {}
+
+def get_encoding(model_name):
+    if model_name not in _encodings:
+        try:
+            try:
+                encoding = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # Encoding files are downloaded on first use, fall back to an estimate when unreachable
+            logger.error("Failed to load tiktoken encoding for %s, estimating tokens: %s", model_name, str(e))
+            encoding = None
+        _encodings[model_name] = encoding
+    return _encodings[model_name]
+
+def count_tokens(text, model_name):
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return len(str(text)) // APPROX_CHARS_PER_TOKEN + 1
+    return len(encoding.encode(str(text)))
+
+def truncate_tokens(text, max_tokens, model_name):
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        max_chars = max_tokens * APPROX_CHARS_PER_TOKEN
+        return text if len(text) <= max_chars else text[:max_chars] + " ...[truncated]"
+    tokens = encoding.encode(str(text))
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens]) + " ...[truncated]"
+
+# Compacts chat history to a per-stage token budget. Messages are compacted once per (session, last chatId)
+# and every stage takes the newest messages that fit its budget from the same compacted forms
+class HistoryCompactor:
+    def __init__(self, recent_field_tokens, older_field_tokens, max_entries):
+        self.recent_field_tokens = recent_field_tokens
+        self.older_field_tokens = older_field_tokens
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _compact_message(self, message, field_tokens, model_name):
+        return {
+            key: truncate_tokens(value, field_tokens, model_name) if isinstance(value, str) else value
+            for key, value in message.items()
+        }
+
+    def _compacted_messages(self, session_key, last_chat_id, model_name):
+        # chatId -> (compacted message, tokens) of one session turn
+        key = (session_key, last_chat_id, model_name)
+        with self._lock:
+            compacted = self._cache.get(key)
+            if compacted is None:
+                compacted = self._cache[key] = {}
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.move_to_end(key)
+            return compacted
+
+    def compact(self, session_key, last_chat_id, messages, budget, model_name):
+        """
+        Newest first messages (a selection of the session's history) cut to budget tokens.
+        The session's latest message (last_chat_id) keeps more detail than older ones.
+        """
+        if not messages or not budget:
+            return messages
+        compacted_messages = self._compacted_messages(session_key, last_chat_id, model_name)
+        selected = []
+        used = 0
+        for message in messages:
+            chat_id = message.get('chatId')
+            compacted = compacted_messages.get(chat_id)
+            if compacted is None:
+                field_tokens = self.recent_field_tokens if chat_id == last_chat_id else self.older_field_tokens
+                compact_message = self._compact_message(message, field_tokens, model_name)
+                compacted = (compact_message, count_tokens(compact_message, model_name))
+                with self._lock:
+                    compacted_messages[chat_id] = compacted
+            compact_message, message_tokens = compacted
+            if selected and used + message_tokens > budget:
+                break
+            selected.append(compact_message)
+            used += message_tokens
+        return selected
+
+history_compactor = HistoryCompactor(
+    settings.history_recent_field_tokens,
+    settings.history_older_field_tokens,
+    settings.history_cache_size
+)
@@ -0,0 +1,203 @@
+from config import settings
+import numpy as np
+import threading
+import logging
+import json
+import time
+import re
+import os
+
+# Application logger
+logger = logging.getLogger("AI DataExplorer")
+
+# Exemplar labels: a self-contained question, a turn that needs prior messages, or a turn answered with a fixed reply
+STANDALONE = "standalone"
+FOLLOW_UP = "followup"
+DIRECT = "direct"
+
+# Wording that leans on earlier turns, such messages go to the LLM classifier whenever there is history
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(above|previous|previously|earlier|again|retry|redo|re-do|same|that|those|these|it|them|instead|last|before)\b"
+    r"|^\s*(and|also|now|what about|how about)\b",
+    re.IGNORECASE
+)
+
+# Data-modifying or schema-altering SQL wording, the LLM classifier answers those turns with its prohibited-operations rule
+PROHIBITED_SQL_PATTERN = re.compile(r"\b(delete|insert|update|truncate|create|drop|alter|merge|grant|revoke)\b", re.IGNORECASE)
+
+def exemplar_text(text):
+    return " ".join(str(text).lower().split())
+
+def label_from_decision(decision):
+    """Exemplar label of an intent classifier decision (the JSON returned by the LLM)."""
+    if decision.get("context_required") or decision.get("chatId"):
+        return FOLLOW_UP
+    if not decision.get("run_downstream_llm") and decision.get("response"):
+        return DIRECT
+    return STANDALONE
+
+def decisions_agree(local, llm):
+    """Whether a local decision routes the turn the way the LLM classifier did."""
+    if label_from_decision(local) != label_from_decision(llm):
+        return False
+    if local["run_downstream_llm"] != bool(llm.get("run_downstream_llm")):
+        return False
+    return local["run_downstream_llm"] or local["response"].strip() == str(llm.get("response", "")).strip()
+
+# Resolves confident intent decisions from the nearest labelled exemplars (embedding similarity),
+# ambiguous turns and follow-ups are deferred to the LLM classifier
+class IntentPreClassifier:
+    def __init__(self, embed, exemplars_path, similarity_threshold, margin, seed_exemplars=(), resolve_with_history=False):
+        self.embed = embed
+        self.exemplars_path = exemplars_path
+        self.similarity_threshold = similarity_threshold
+        self.margin = margin
+        # Turns with chat history go to the LLM (context selection, rephrasing) unless shadow agreement supports more
+        self.resolve_with_history = resolve_with_history
+        self.seed_exemplars = list(seed_exemplars)
+        self._exemplars = None
+        self._vectors = None
+        self._lock = threading.Lock()
+        self.metrics = {"resolved": 0, "deferred": 0, "shadow_agreements": 0, "shadow_disagreements": 0}
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def load_exemplars(self):
+        exemplars = list(self.seed_exemplars)
+        if self.exemplars_path and os.path.exists(self.exemplars_path):
+            with open(self.exemplars_path, "r") as file:
+                exemplars.extend(json.load(file))
+        return [exemplar for exemplar in exemplars if exemplar.get("text") and exemplar.get("label") in (STANDALONE, FOLLOW_UP, DIRECT)]
+
+    def ensure_loaded(self):
+        if self._vectors is not None:
+            return
+        with self._lock:
+            if self._vectors is None:
+                exemplars = self.load_exemplars()
+                vectors = [self.embed(exemplar["text"]) for exemplar in exemplars]
+                self._exemplars = exemplars
+                self._vectors = self._normalize(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+
+    def reload(self):
+        with self._lock:
+            self._exemplars = None
+            self._vectors = None
+
+    def predict(self, user_prompt, has_history, leave_out=False, resolve_with_history=None):
+        """
+        Nearest exemplar label with its similarity and margin over the best exemplar of another label.
+        confident is False when the turn should go to the LLM classifier.
+        leave_out ignores exemplars with the same text as user_prompt (offline evaluation).
+        resolve_with_history overrides the instance setting (shadow mode measures turns with history too).
+        """
+        if resolve_with_history is None:
+            resolve_with_history = self.resolve_with_history
+        if PROHIBITED_SQL_PATTERN.search(str(user_prompt)):
+            return {"label": None, "similarity": None, "margin": None, "confident": False, "reason": "SQL operation wording"}
+        if has_history and FOLLOW_UP_PATTERN.search(str(user_prompt)):
+            return {"label": FOLLOW_UP, "similarity": None, "margin": None, "confident": False, "reason": "follow-up wording"}
+        if has_history and not resolve_with_history:
+            return {"label": FOLLOW_UP, "similarity": None, "margin": None, "confident": False, "reason": "chat history"}
+        self.ensure_loaded()
+        if not len(self._vectors):
+            return {"label": None, "similarity": None, "margin": None, "confident": False, "reason": "no exemplars"}
+        similarities = self._vectors @ self._normalize(self.embed(str(user_prompt)))
+        if leave_out:
+            text = exemplar_text(user_prompt)
+            similarities = np.where([exemplar_text(exemplar["text"]) == text for exemplar in self._exemplars], -np.inf, similarities)
+            if not np.isfinite(similarities).any():
+                return {"label": None, "similarity": None, "margin": None, "confident": False, "reason": "no exemplars"}
+        best = int(np.argmax(similarities))
+        exemplar = self._exemplars[best]
+        other_labels = [
+            float(similarity) for similarity, other in zip(similarities, self._exemplars) if other["label"] != exemplar["label"]
+        ]
+        margin = float(similarities[best]) - max(other_labels, default=-1.0)
+        confident = (
+            exemplar["label"] != FOLLOW_UP
+            and similarities[best] >= self.similarity_threshold
+            and margin >= self.margin
+        )
+        return {
+            "label": exemplar["label"],
+            "similarity": float(similarities[best]),
+            "margin": margin,
+            "confident": bool(confident),
+            "reason": f"nearest exemplar '{exemplar['text']}'",
+            "response": exemplar.get("response", ""),
+        }
+
+    def decision(self, user_prompt, prediction):
+        """Builds the intent classifier JSON for a confident prediction."""
+        reason = f"Resolved locally ({prediction['label']}, similarity {prediction['similarity']:.3f})"
+        if prediction["label"] == DIRECT:
+            return {
+                "context_required": False,
+                "reason": reason,
+                "chatId": [],
+                "response": prediction["response"],
+                "run_downstream_llm": False,
+                "rephrased_query": "",
+            }
+        return {
+            "context_required": False,
+            "reason": reason,
+            "chatId": [],
+            "response": "",
+            "run_downstream_llm": True,
+            "rephrased_query": str(user_prompt),
+        }
+
+    def classify(self, user_prompt, has_history):
+        """Intent classifier JSON for a confident turn, None defers the turn to the LLM."""
+        prediction = self.predict(user_prompt, has_history)
+        with self._lock:
+            self.metrics["resolved" if prediction["confident"] else "deferred"] += 1
+        if not prediction["confident"]:
+            logger.debug("Intent pre-classifier deferred: %s", prediction["reason"])
+            return None
+        return self.decision(user_prompt, prediction)
+
+    def shadow(self, user_prompt, has_history, llm_decision):
+        """Compares a local prediction with the LLM decision without acting on it, returns the prediction."""
+        prediction = self.predict(user_prompt, has_history, resolve_with_history=True)
+        if prediction["confident"]:
+            agrees = decisions_agree(self.decision(user_prompt, prediction), llm_decision)
+            with self._lock:
+                self.metrics["shadow_agreements" if agrees else "shadow_disagreements"] += 1
+            prediction["agrees"] = agrees
+        return prediction
+
+    def stats(self):
+        with self._lock:
+            return {**self.metrics, "exemplars": len(self._exemplars) if self._exemplars is not None else 0}
+
+_decision_log_lock = threading.Lock()
+
+def record_intent_decision(datasource, user_prompt, has_history, decision, local_prediction=None, path=None, session_id=None):
+    """
+    Appends an intent decision to INTENT_DECISION_LOG (JSON lines), the input of intent_eval.py
+    and the source of exemplars exported from logged LLM decisions.
+    """
+    path = path or settings.intent_decision_log
+    if not path:
+        return
+    entry = {
+        "timestamp": time.time(),
+        "sessionId": session_id,
+        "datasource": datasource,
+        "userPrompt": user_prompt,
+        "has_history": bool(has_history),
+        "decision": decision,
+        "local": local_prediction,
+    }
+    try:
+        with _decision_log_lock, open(path, "a") as file:
+            file.write(json.dumps(entry, default=str) + "\n")
+    except Exception as e:
+        logger.error("Failed to record intent decision: %s", str(e))
@@ -0,0 +1,154 @@
+import threading
+import json
+import re
+
+CODE_FENCE_PATTERN = re.compile(r"^\s*```[a-zA-Z]*\s*\n?(.*?)\n?\s*```\s*$", re.DOTALL)
+NUMBER_PATTERN = re.compile(r"^-?\d+(\.\d+)?$")
+
+def strip_code_fences(text):
+    match = CODE_FENCE_PATTERN.match(text)
+    return match.group(1) if match else text
+
+def extract_outermost_object(text):
+    """Returns the first balanced {...} block, ignoring braces inside JSON strings."""
+    start = text.find('{')
+    if start == -1:
+        return text
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1]
+    return text[start:]
+
+def remove_trailing_commas(text):
+    """Drops commas directly before a closing bracket, outside JSON strings."""
+    output = []
+    in_string = False
+    escaped = False
+    pending_comma = None
+    for char in text:
+        if in_string:
+            output.append(char)
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if pending_comma is not None:
+            if char.isspace():
+                pending_comma.append(char)
+                continue
+            if char not in '}]':
+                output.extend(pending_comma)
+            else:
+                output.extend(pending_comma[1:])
+            pending_comma = None
+        if char == ',':
+            pending_comma = [char]
+            continue
+        if char == '"':
+            in_string = True
+        output.append(char)
+    if pending_comma is not None:
+        output.extend(pending_comma)
+    return ''.join(output)
+
+def _coerce_number(value):
+    if isinstance(value, str) and NUMBER_PATTERN.match(value.strip().replace(',', '')):
+        number = value.strip().replace(',', '')
+        return float(number) if '.' in number else int(number)
+    if isinstance(value, list):
+        return [_coerce_number(item) for item in value]
+    return value
+
+# Text level repairs, applied in order until the payload parses
+TEXT_REPAIRS = [
+    ("strip_code_fences", strip_code_fences),
+    ("extract_outermost_object", extract_outermost_object),
+    ("remove_trailing_commas", remove_trailing_commas),
+]
+
+# Repairs structured LLM responses locally so only genuinely broken payloads go back to the LLM
+class JsonRepairer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.metrics = {"parsed": 0, "repaired": 0, "unrepairable": 0, "llm_fallbacks": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.metrics[name] = self.metrics.get(name, 0) + 1
+
+    def _parse(self, text):
+        try:
+            return json.loads(text), []
+        except json.JSONDecodeError:
+            pass
+        repairs = []
+        for name, repair in TEXT_REPAIRS:
+            repaired_text = repair(text)
+            if repaired_text == text:
+                continue
+            text = repaired_text
+            repairs.append(name)
+            try:
+                return json.loads(text), repairs
+            except json.JSONDecodeError:
+                continue
+        return None, repairs
+
+    def _normalize(self, parsed_json):
+        repairs = []
+        if not isinstance(parsed_json, dict):
+            return parsed_json, repairs
+        visualization = parsed_json.get("visualization")
+        if "visualization" in parsed_json and visualization == {}:
+            parsed_json["visualization"] = None
+            repairs.append("empty_visualization")
+        elif isinstance(visualization, dict) and "y" in visualization:
+            coerced = _coerce_number(visualization["y"])
+            if coerced != visualization["y"] or type(coerced) != type(visualization["y"]):
+                visualization["y"] = coerced
+                repairs.append("coerce_chart_y")
+        return parsed_json, repairs
+
+    def repair(self, text):
+        """
+        Returns (parsed_json, repairs) for an LLM response, parsed_json is None when no local repair worked.
+        """
+        parsed_json, repairs = self._parse(str(text))
+        if parsed_json is None:
+            self._count("unrepairable")
+            return None, repairs
+        parsed_json, normalize_repairs = self._normalize(parsed_json)
+        repairs += normalize_repairs
+        self._count("repaired" if repairs else "parsed")
+        for name in repairs:
+            self._count(f"repair_{name}")
+        return parsed_json, repairs
+
+    def record_llm_fallback(self):
+        self._count("llm_fallbacks")
+
+    def stats(self):
+        with self._lock:
+            return dict(self.metrics)
+
+json_repairer = JsonRepairer()
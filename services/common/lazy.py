@@ -0,0 +1,21 @@
+import threading
+
+# Proxy that builds the wrapped client on first attribute access, keeps heavy clients out of module import
+class LazyObject:
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    def is_resolved(self):
+        return self._instance is not None
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
@@ -0,0 +1,71 @@
+from langchain_openai import AzureChatOpenAI
+from config import settings
+import threading
+import httpx
+
+# Shared HTTP connection pool for every chat connector in the process, the pipeline only makes sync calls
+llm_http_limits = httpx.Limits(
+    max_connections=settings.llm_max_connections,
+    max_keepalive_connections=settings.llm_max_keepalive_connections
+)
+llm_http_client = httpx.Client(limits=llm_http_limits)
+
+_connectors = {}
+_connectors_lock = threading.Lock()
+
+def _build_connector(llm_config_key, streaming_usage=False):
+    llm_config = settings.LLM_Config[llm_config_key]
+    extra_kwargs = {}
+    if streaming_usage:
+        extra_kwargs['model_kwargs'] = {"stream_options": {"include_usage": True}}
+    return AzureChatOpenAI(
+        azure_deployment=llm_config['deployment_name'],
+        api_version=llm_config['api_version'],
+        azure_endpoint=llm_config['endpoint'],
+        api_key=llm_config['subscription_key'],
+        temperature=0,
+        max_tokens=None,
+        timeout=30,
+        max_retries=1,
+        http_client=llm_http_client,
+        **extra_kwargs
+    )
+
+def get_llm_connectors(llm_config_key):
+    """
+    Returns the (llm_connector, llm_connector_agent) pair for an LLM_Config key.
+    Connectors are stateless and built once per process, per-request state stays on Main.
+    """
+    connectors = _connectors.get(llm_config_key)
+    if connectors is not None:
+        return connectors
+    with _connectors_lock:
+        connectors = _connectors.get(llm_config_key)
+        if connectors is None:
+            connectors = (
+                _build_connector(llm_config_key),
+                _build_connector(llm_config_key, streaming_usage=True)
+            )
+            _connectors[llm_config_key] = connectors
+        return connectors
+
+def get_structured_connector(llm_config_key, schema):
+    """
+    Returns llm_connector bound to a Pydantic response model using the model's native structured output.
+    The raw message is kept so callers can fall back to free-text parsing when binding fails.
+    """
+    key = (llm_config_key, schema.__name__)
+    connector = _connectors.get(key)
+    if connector is not None:
+        return connector
+    llm_connector, _ = get_llm_connectors(llm_config_key)
+    with _connectors_lock:
+        connector = _connectors.get(key)
+        if connector is None:
+            connector = llm_connector.with_structured_output(
+                schema,
+                method=settings.structured_output_method,
+                include_raw=True
+            )
+            _connectors[key] = connector
+        return connector
@@ -0,0 +1,126 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import hashlib
+import logging
+import json
+import time
+
+# Application logger
+logger = logging.getLogger("AI DataExplorer")
+
+def schema_fingerprint(snapshot):
+    """
+    Hash of the table schemas (column metadata by table name) of a snapshot.
+    Sample records and table order vary between refreshes of an unchanged catalog and are left out.
+    """
+    schema = {
+        str(table.get("tableName")): table.get("metadata")
+        for table in snapshot.get("tables") or [] if isinstance(table, dict)
+    }
+    return hashlib.sha256(json.dumps(schema, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+# In-memory metadata snapshots per datasource with stale-while-revalidate refresh
+class MetadataSnapshotCache:
+    def __init__(self, loader, datasources, ttl, refresh_interval, on_change=None, empty_ttl=30):
+        self.loader = loader
+        self.datasources = [datasource.lower() for datasource in datasources]
+        self.ttl = ttl
+        # Snapshots without tables (failed loads) are retried after this short negative TTL
+        self.empty_ttl = empty_ttl
+        self.refresh_interval = refresh_interval
+        self.on_change = on_change
+        self._snapshots = {}
+        self._expires_at = {}
+        self._fingerprints = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._scheduler = None
+        self._stop = threading.Event()
+
+    def _load_lock(self, datasource):
+        with self._lock:
+            return self._load_locks.setdefault(datasource, threading.Lock())
+
+    def refresh(self, datasource):
+        datasource = datasource.lower()
+        start_time = time.monotonic()
+        snapshot = self.loader(datasource)
+        fingerprint = schema_fingerprint(snapshot)
+        with self._lock:
+            previous = self._snapshots.get(datasource)
+            if previous and previous.get("tables") and not snapshot.get("tables"):
+                # Keep serving the last good snapshot if Databricks returned nothing
+                logger.error("Metadata refresh for %s returned no tables, keeping previous snapshot", datasource)
+                return previous
+            previous_fingerprint = self._fingerprints.get(datasource)
+            self._snapshots[datasource] = snapshot
+            self._fingerprints[datasource] = fingerprint
+            self._expires_at[datasource] = time.monotonic() + (self.ttl if snapshot.get("tables") else self.empty_ttl)
+        logger.info("Metadata snapshot for %s refreshed in %.2f ms", datasource, (time.monotonic() - start_time) * 1000)
+        # An empty previous snapshot was a failed load, not a catalog whose change invalidates anything
+        if previous and previous.get("tables") and previous_fingerprint != fingerprint and self.on_change:
+            self.on_change(datasource)
+        return snapshot
+
+    def _usable(self, datasource, snapshot):
+        # Caller must hold the lock, an expired empty snapshot is reloaded synchronously instead of served
+        return snapshot is not None and (snapshot.get("tables") or time.monotonic() <= self._expires_at[datasource])
+
+    def _background_refresh(self, datasource):
+        try:
+            self._locked_refresh(datasource)
+        except Exception as e:
+            logger.error("Background metadata refresh for %s failed: %s", datasource, str(e))
+        finally:
+            with self._lock:
+                self._refreshing.discard(datasource)
+
+    def get(self, datasource):
+        datasource = datasource.lower()
+        with self._lock:
+            snapshot = self._snapshots.get(datasource)
+            if not self._usable(datasource, snapshot):
+                snapshot = None
+            stale = snapshot is not None and time.monotonic() > self._expires_at[datasource]
+            if stale and datasource not in self._refreshing:
+                self._refreshing.add(datasource)
+                threading.Thread(target=self._background_refresh, args=(datasource,), daemon=True).start()
+        if snapshot is not None:
+            return snapshot
+
+        # Cold miss: one loader per datasource, concurrent callers wait for it
+        with self._load_lock(datasource):
+            with self._lock:
+                snapshot = self._snapshots.get(datasource)
+                if self._usable(datasource, snapshot):
+                    return snapshot
+            return self.refresh(datasource)
+
+    def _locked_refresh(self, datasource):
+        with self._load_lock(datasource):
+            return self.refresh(datasource)
+
+    def refresh_all(self):
+        with ThreadPoolExecutor(max_workers=max(len(self.datasources), 1)) as executor:
+            futures = {executor.submit(self._locked_refresh, datasource): datasource for datasource in self.datasources}
+            for future, datasource in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error("Metadata refresh for %s failed: %s", datasource, str(e))
+
+    def _run_scheduler(self):
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh_all()
+
+    def start(self, warm=True):
+        if warm:
+            threading.Thread(target=self.refresh_all, name="metadata-warmup", daemon=True).start()
+        if self.refresh_interval > 0 and (self._scheduler is None or not self._scheduler.is_alive()):
+            self._stop.clear()
+            self._scheduler = threading.Thread(target=self._run_scheduler, name="metadata-refresh", daemon=True)
+            self._scheduler.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,125 @@
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily
+import logging
+import time
+
+# Application logger
+logger = logging.getLogger("AI DataExplorer")
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 200, 500, 1000, 5000, 10000, 100000)
+
+CHAT_TIME_TO_FIRST_TOKEN = Histogram(
+    "chat_time_to_first_token_seconds", "Time from request to the first non-empty streamed chunk",
+    ["datasource"], buckets=LATENCY_BUCKETS
+)
+CHAT_TURN_LATENCY = Histogram(
+    "chat_turn_latency_seconds", "Total time to stream a chat turn including the structured response",
+    ["datasource"], buckets=LATENCY_BUCKETS
+)
+CHATS_IN_FLIGHT = Gauge("chat_streams_in_flight", "Chat responses currently streaming", ["datasource"])
+LLM_TOKENS = Counter("llm_tokens_total", "LLM tokens consumed per chat turn", ["datasource", "model", "direction"])
+LLM_COST = Counter("llm_cost_usd_total", "LLM cost in USD as computed by Main.calculate_cost", ["datasource", "model", "direction"])
+DATABRICKS_QUERY_LATENCY = Histogram(
+    "databricks_query_latency_seconds", "Databricks statement latency", ["kind", "status"], buckets=LATENCY_BUCKETS
+)
+DATABRICKS_QUERY_ROWS = Histogram("databricks_query_rows", "Rows returned per Databricks statement", ["kind"], buckets=ROW_BUCKETS)
+SEARCH_LATENCY = Histogram("search_query_latency_seconds", "Azure AI Search query latency", ["index"], buckets=LATENCY_BUCKETS)
+COSMOS_LATENCY = Histogram(
+    "cosmos_request_latency_seconds", "Cosmos DB request latency", ["container", "operation"], buckets=LATENCY_BUCKETS
+)
+COSMOS_REQUEST_CHARGE = Counter("cosmos_request_units_total", "Cosmos DB request units consumed", ["container", "operation"])
+PROMPT_FORMAT_LATENCY = Histogram(
+    "prompt_format_latency_seconds", "Time to format a prompt template", ["template"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+)
+PROMPT_CHARS = Histogram(
+    "prompt_chars", "Characters of a formatted prompt", ["template"],
+    buckets=(1000, 5000, 10000, 25000, 50000, 100000, 200000, 400000)
+)
+
+def record_llm_usage(datasource, model, input_tokens, output_tokens, input_cost, output_cost):
+    datasource = datasource.lower()
+    LLM_TOKENS.labels(datasource, model, "input").inc(input_tokens)
+    LLM_TOKENS.labels(datasource, model, "output").inc(output_tokens)
+    LLM_COST.labels(datasource, model, "input").inc(input_cost)
+    LLM_COST.labels(datasource, model, "output").inc(output_cost)
+
+def record_databricks_query(kind, duration, rows=None, failed=False):
+    DATABRICKS_QUERY_LATENCY.labels(kind, "error" if failed else "ok").observe(duration)
+    if rows is not None:
+        DATABRICKS_QUERY_ROWS.labels(kind).observe(rows)
+
+def record_prompt_format(template, duration, prompt_chars):
+    PROMPT_FORMAT_LATENCY.labels(template).observe(duration)
+    PROMPT_CHARS.labels(template).observe(prompt_chars)
+
+def record_cosmos_request(container, operation, duration, request_charge=None):
+    COSMOS_LATENCY.labels(container, operation).observe(duration)
+    if request_charge is not None:
+        COSMOS_REQUEST_CHARGE.labels(container, operation).inc(request_charge)
+
+class ChatStreamTimer:
+    """Tracks in-flight streams, time to first token and total turn latency for one chat."""
+    def __init__(self, datasource):
+        self.datasource = datasource.lower()
+        self.start_time = time.perf_counter()
+        self.first_token = False
+        CHATS_IN_FLIGHT.labels(self.datasource).inc()
+
+    def chunk(self, chunk):
+        if chunk and not self.first_token:
+            self.first_token = True
+            CHAT_TIME_TO_FIRST_TOKEN.labels(self.datasource).observe(time.perf_counter() - self.start_time)
+
+    def finish(self):
+        CHATS_IN_FLIGHT.labels(self.datasource).dec()
+        CHAT_TURN_LATENCY.labels(self.datasource).observe(time.perf_counter() - self.start_time)
+
+def instrument_stream(stream, datasource):
+    timer = ChatStreamTimer(datasource)
+    try:
+        for chunk in stream:
+            timer.chunk(chunk)
+            yield chunk
+    finally:
+        # Propagate client disconnects to the pipeline generator
+        stream.close()
+        timer.finish()
+
+async def ainstrument_stream(stream, datasource):
+    timer = ChatStreamTimer(datasource)
+    try:
+        async for chunk in stream:
+            timer.chunk(chunk)
+            yield chunk
+    finally:
+        await stream.aclose()
+        timer.finish()
+
+# Exposes the stats() of pools, caches and queues as gauges at scrape time
+class ComponentStatsCollector:
+    def __init__(self):
+        self.sources = {}
+
+    def register(self, component, stats):
+        self.sources[component] = stats
+
+    def collect(self):
+        gauge = GaugeMetricFamily("component_stat", "Pool, cache and queue statistics", labels=["component", "stat"])
+        for component, stats in self.sources.items():
+            try:
+                values = stats()
+            except Exception as e:
+                logger.error("Failed to collect stats for %s: %s", component, str(e))
+                continue
+            for stat, value in values.items():
+                if isinstance(value, (int, float)):
+                    gauge.add_metric([component, stat], float(value))
+        yield gauge
+
+component_stats = ComponentStatsCollector()
+REGISTRY.register(component_stats)
+
+def render_metrics():
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
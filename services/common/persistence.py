@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from config import settings
+import threading
+import logging
+import time
+
+# Application logger
+logger = logging.getLogger("AI DataExplorer")
+
+# Background write-behind queue, later writes for the same key replace pending ones.
+# A pool of workers writes concurrently, writes of one group (a chat session) run one at a time in queue order.
+# Failed writes are re-queued with a due time so one failing key does not hold up the others,
+# values of unpersisted writes stay readable per group (pending) until they are written.
+class WriteBehindQueue:
+    def __init__(self, max_retries, retry_backoff, workers=1):
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.workers = max(1, workers)
+        # key -> (write, attempt, due, seq, group)
+        self._pending = OrderedDict()
+        # key -> (group, value, seq) of writes not persisted yet
+        self._values = {}
+        # Groups (or keys of ungrouped writes) with a write in flight
+        self._busy = {}
+        self._seq = 0
+        self._in_flight = 0
+        self._lock = threading.Condition()
+        self._workers = []
+        self.metrics = {"enqueued": 0, "coalesced": 0, "written": 0, "retries": 0, "failed": 0}
+
+    @staticmethod
+    def _lane(key, group):
+        return ("group", group) if group is not None else ("key", key)
+
+    def _ensure_workers(self):
+        # Caller must hold the lock
+        self._workers = [worker for worker in self._workers if worker.is_alive()]
+        while len(self._workers) < self.workers:
+            worker = threading.Thread(target=self._run, name=f"write-behind-{len(self._workers)}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def enqueue(self, key, write, group=None, value=None):
+        with self._lock:
+            self.metrics["enqueued"] += 1
+            if key in self._pending:
+                self.metrics["coalesced"] += 1
+            self._seq += 1
+            # A new write resets the retry state of a failed one for the same key
+            self._pending[key] = (write, 0, 0.0, self._seq, group)
+            if value is not None:
+                self._values[key] = (group, value, self._seq)
+            self._ensure_workers()
+            self._lock.notify_all()
+
+    def pending(self, group):
+        """Values enqueued for group that are not written yet (queued, in flight or waiting for a retry)."""
+        with self._lock:
+            return [value for value_group, value, seq in self._values.values() if value_group == group]
+
+    def _next_due(self):
+        # Caller must hold the lock, returns (key, None) for a due write of an idle lane or (None, seconds until the next retry)
+        now = time.monotonic()
+        delay = None
+        for key, (write, attempt, due, seq, group) in self._pending.items():
+            if self._lane(key, group) in self._busy:
+                continue
+            if due <= now:
+                return key, None
+            delay = due - now if delay is None else min(delay, due - now)
+        return None, delay
+
+    def _run(self):
+        while True:
+            with self._lock:
+                key, delay = self._next_due()
+                while key is None:
+                    self._lock.wait(delay)
+                    key, delay = self._next_due()
+                write, attempt, due, seq, group = self._pending.pop(key)
+                lane = self._lane(key, group)
+                self._busy[lane] = group
+                self._in_flight += 1
+            try:
+                self._write(key, write, attempt, seq, group)
+            finally:
+                with self._lock:
+                    del self._busy[lane]
+                    self._in_flight -= 1
+                    self._lock.notify_all()
+
+    def _discard_value(self, key, seq):
+        # Caller must hold the lock, a newer value for the key stays readable
+        if key in self._values and self._values[key][2] == seq:
+            del self._values[key]
+
+    def _write(self, key, write, attempt, seq, group):
+        try:
+            write()
+        except Exception as e:
+            with self._lock:
+                if attempt < self.max_retries:
+                    self.metrics["retries"] += 1
+                    # Unless a newer write for the key was enqueued meanwhile
+                    if key not in self._pending:
+                        self._pending[key] = (write, attempt + 1, time.monotonic() + self.retry_backoff * (2 ** attempt), seq, group)
+                    return
+                self.metrics["failed"] += 1
+                self._discard_value(key, seq)
+            logger.error("Write-behind failed for %s after %s attempts: %s", key, attempt + 1, str(e))
+            return
+        with self._lock:
+            self.metrics["written"] += 1
+            self._discard_value(key, seq)
+
+    def _has_writes(self, group):
+        # Caller must hold the lock
+        if group is None:
+            return bool(self._pending or self._in_flight)
+        return (
+            any(entry[4] == group for entry in self._pending.values())
+            or ("group", group) in self._busy
+        )
+
+    def flush(self, timeout=None, group=None):
+        """
+        Block until every pending write (of group, when given) has been attempted; returns False on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._has_writes(group):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._lock.wait(remaining)
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.metrics,
+                "pending": len(self._pending),
+                "in_flight": self._in_flight,
+                "unpersisted_values": len(self._values),
+                "workers": self.workers,
+            }
+
+chat_persistence_queue = WriteBehindQueue(settings.persistence_max_retries, settings.persistence_retry_backoff, settings.persistence_workers)
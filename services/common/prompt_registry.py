@@ -0,0 +1,98 @@
+from langchain.prompts import PromptTemplate
+from services.prompts import user_prompt_rephraser, column_retriever, query_response_generator, \
+final_response_generator, intent_classifier, research_explorer, sohea_classifier, validation_agent
+from services.common.utils import source_specific_user_prompts
+from services.common.metrics import record_prompt_format
+from datetime import datetime
+import threading
+
+PROMPT_SOURCES = {
+    "intent_classifier": intent_classifier.CLASSIFIER,
+    "user_prompt_rephraser": user_prompt_rephraser.USER_PROMPT_REPHRASER,
+    "year_validation": validation_agent.YEAR_Validation_,
+    "column_retriever": column_retriever.COLUMN_RETRIEVER_PROMPT,
+    "query_generator": query_response_generator.QUERY_GENERATOR_PROMPT,
+    "response_generator": final_response_generator.RESPONSE_GENERATOR_,
+    "structured_response_generator": final_response_generator.STRUCTURED_RESPONSE_GENERATOR_,
+    "research_explorer_retriever": research_explorer.RESEARCH_EXPLORER_RETRIEVER,
+    "research_explorer_decision_agent": research_explorer.DECISION_AGENT_PROMPT,
+    "research_structured_response_generator": research_explorer.STRUCTURED_RESPONSE_GENERATOR_,
+    "research_explorer_intent_classifier": research_explorer.INTENT_CLASSIFIER,
+    "sohea_denominator_classifier": sohea_classifier.Denominator_classifier,
+    "sohea_year_classifier": sohea_classifier.Year_Scope_classifier,
+    "sohea_mapping_agent": sohea_classifier.hierachy_mapping_agent,
+}
+
+# Datasource specific rephraser, column retriever and query generator instructions plus followup suggestions
+DATASOURCE_INSTRUCTIONS = {
+    "ahrf": (user_prompt_rephraser.AHRF_USER_PROMPT_REPHRASER, column_retriever.AHRF_COLUMN_RETRIEVER_PROMPT,
+             query_response_generator.AHRF_QUERY_GENERATOR_PROMPT, source_specific_user_prompts['ahrf']),
+    "hpsa": (user_prompt_rephraser.HPSA_USER_PROMPT_REPHRASER, column_retriever.HPSA_COLUMN_RETRIEVER_PROMPT,
+             query_response_generator.HPSA_QUERY_GENERATOR_PROMPT, source_specific_user_prompts['hpsa']),
+    "merative": (user_prompt_rephraser.MERATIVE_USER_PROMPT_REPHRASER, column_retriever.MERATIVE_COLUMN_RETRIEVER_PROMPT,
+                 query_response_generator.MERATIVE_QUERY_GENERATOR_PROMPT, source_specific_user_prompts['merative']),
+    "sohea": (user_prompt_rephraser.SOHEA_USER_PROMPT_REPHRASER, column_retriever.SOHEA_COLUMN_RETRIEVER_PROMPT,
+              query_response_generator.SOHEA_QUERY_GENERATOR_PROMPT, source_specific_user_prompts['sohea']),
+    "dqddma": (user_prompt_rephraser.DQ_DDMA_USER_PROMPT_REPHRASER, column_retriever.DQ_DDMA_COLUMN_RETRIEVER_PROMPT,
+               query_response_generator.DQ_DDMA_QUERY_GENERATOR_PROMPT, source_specific_user_prompts.get('dqddma')),
+}
+
+def datasource_partials(datasource):
+    rephraser_instructions, column_retriever_instructions, query_generator_instructions, followup_suggestions = DATASOURCE_INSTRUCTIONS[datasource]
+    return {
+        "user_prompt_rephraser": {"datasource_specific_instructions": rephraser_instructions},
+        "column_retriever": {"data_source_specific_instruction": column_retriever_instructions},
+        "query_generator": {"datasource_specific_instructions": query_generator_instructions},
+        "structured_response_generator": {"datasource_specific_user_prompts": followup_suggestions},
+    }
+
+# Prompt templates compiled once per process, with datasource partials pre-bound
+class PromptRegistry:
+    def __init__(self, sources, datasources):
+        self.templates = {name: PromptTemplate.from_template(source) for name, source in sources.items()}
+        self.datasource_templates = {
+            datasource: {
+                name: self.templates[name].partial(**partials)
+                for name, partials in datasource_partials(datasource).items()
+            }
+            for datasource in datasources
+        }
+        self._lock = threading.Lock()
+        self.metrics = {}
+
+    def get(self, name, datasource=None):
+        if datasource:
+            template = self.datasource_templates.get(datasource.lower(), {}).get(name)
+            if template is not None:
+                return template
+        return self.templates[name]
+
+    def _record(self, name, duration_ms, prompt_chars):
+        with self._lock:
+            stats = self.metrics.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "last_chars": 0, "max_chars": 0})
+            stats["count"] += 1
+            stats["total_ms"] += duration_ms
+            stats["max_ms"] = max(stats["max_ms"], duration_ms)
+            stats["last_chars"] = prompt_chars
+            stats["max_chars"] = max(stats["max_chars"], prompt_chars)
+        record_prompt_format(name, duration_ms / 1000, prompt_chars)
+
+    def format(self, name, datasource=None, **kwargs):
+        start_time = datetime.now()
+        prompt = self.get(name, datasource).format(**kwargs)
+        self._record(name, (datetime.now() - start_time).total_seconds() * 1000, len(prompt))
+        return prompt
+
+    def partial(self, name, datasource=None, **kwargs):
+        start_time = datetime.now()
+        template = self.get(name, datasource).partial(**kwargs)
+        # Agent prompts are rendered by the agent itself, size covers the template and bound values
+        prompt_chars = len(template.template) + sum(len(str(value)) for value in template.partial_variables.values())
+        self._record(name, (datetime.now() - start_time).total_seconds() * 1000, prompt_chars)
+        return template
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(stats) for name, stats in self.metrics.items()}
+
+prompt_registry = PromptRegistry(PROMPT_SOURCES, DATASOURCE_INSTRUCTIONS.keys())
@@ -0,0 +1,122 @@
+from collections import OrderedDict
+from config import settings
+from services.common.tracing import set_span_attributes
+from app_logger import log_context
+import threading
+import time
+import re
+
+CACHEABLE_STATEMENTS = ("select", "with", "describe", "show")
+TABLE_PATTERN = re.compile(r"\b(?:from|join|describe)\s+(?:table\s+)?([`\w.]+)", re.IGNORECASE)
+
+def normalize_sql(sql_query):
+    """
+    Collapses whitespace and case outside quoted literals, and drops trailing semicolons,
+    so formatting-only differences map to the same cache key.
+    """
+    parts = re.split(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")", str(sql_query).strip())
+    normalized = []
+    for index, part in enumerate(parts):
+        # Odd positions are quoted literals and keep their exact text
+        normalized.append(part if index % 2 else re.sub(r"\s+", " ", part).lower())
+    return "".join(normalized).strip().rstrip(";").strip()
+
+def referenced_tables(normalized_sql):
+    # Table names without catalog/schema qualifiers or backticks
+    return {match.replace("`", "").split(".")[-1] for match in TABLE_PATTERN.findall(normalized_sql)}
+
+# LRU cache of SQL results keyed by (catalog, normalized SQL) with per-table TTLs
+class QueryResultCache:
+    def __init__(self, max_entries, default_ttl, table_ttls=None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.table_ttls = table_ttls or {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0, "invalidations": 0, "bypassed": 0}
+
+    def _ttl(self, tables):
+        # Shortest TTL among the referenced tables wins
+        return min((self.table_ttls.get(table, self.default_ttl) for table in tables), default=self.default_ttl)
+
+    def execute(self, catalog, sql_query, executor, datasource=None):
+        """
+        Returns the cached result for sql_query or runs executor(sql_query) and caches successful results.
+        Stored results are tagged with datasource (default: the datasource of the current request) for invalidate().
+        """
+        normalized = normalize_sql(sql_query)
+        if not normalized.startswith(CACHEABLE_STATEMENTS):
+            with self._lock:
+                self.metrics["bypassed"] += 1
+            return executor(sql_query)
+        key = (catalog, normalized)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry["expires_at"] > now:
+                    self._entries.move_to_end(key)
+                    self.metrics["hits"] += 1
+                    set_span_attributes(**{"query_cache.hit": True})
+                    return entry["result"]
+                del self._entries[key]
+                self.metrics["expirations"] += 1
+            self.metrics["misses"] += 1
+        set_span_attributes(**{"query_cache.hit": False})
+        result = executor(sql_query)
+        if not isinstance(result, str):
+            # Error strings are never cached
+            tables = referenced_tables(normalized)
+            datasource = datasource or log_context.get().get("datasource")
+            with self._lock:
+                self._entries[key] = {
+                    "result": result,
+                    "tables": tables,
+                    "datasource": datasource.lower() if datasource else None,
+                    "expires_at": time.time() + self._ttl(tables)
+                }
+                self._entries.move_to_end(key)
+                self.metrics["stores"] += 1
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.metrics["evictions"] += 1
+        return result
+
+    def invalidate_table(self, table_name):
+        """Drop cached results reading from table_name, e.g. after a scheduled data refresh."""
+        table_name = table_name.replace("`", "").split(".")[-1].lower()
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if table_name in entry["tables"]]
+            for key in stale:
+                del self._entries[key]
+            self.metrics["invalidations"] += 1
+        return len(stale)
+
+    def invalidate(self, datasource):
+        """
+        Drop cached results of a datasource whose catalog changed.
+        Results stored outside any request context have no datasource and are dropped as well.
+        """
+        datasource = datasource.lower()
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry["datasource"] in (datasource, None)]
+            for key in stale:
+                del self._entries[key]
+            self.metrics["invalidations"] += 1
+        return len(stale)
+
+    def clear(self):
+        """Drop every cached result."""
+        with self._lock:
+            self._entries.clear()
+            self.metrics["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self.metrics, "size": len(self._entries), "max_entries": self.max_entries}
+
+query_cache = QueryResultCache(
+    settings.query_cache_max_entries,
+    settings.query_cache_ttl,
+    settings.query_cache_table_ttls
+)
@@ -0,0 +1,72 @@
+from requests.adapters import HTTPAdapter
+from config import settings
+import requests
+import threading
+
+# Process-wide registry of long-lived SearchClients keyed by (endpoint, index_name)
+class SearchClientRegistry:
+    def __init__(self, pool_connections, pool_maxsize):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._session = None
+
+    def _build_session(self):
+        # Keep-alive session shared by every index client
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def get(self, index_name, endpoint=None):
+        endpoint = endpoint or settings.search_endpoint
+        key = (endpoint, index_name)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                # Azure SDK imports are deferred to the first client, they are costly at startup
+                from azure.search.documents import SearchClient
+                from azure.core.credentials import AzureKeyCredential
+                from azure.core.pipeline.transport import RequestsTransport
+                if self._session is None:
+                    self._session = self._build_session()
+                client = SearchClient(
+                    endpoint=endpoint,
+                    index_name=index_name,
+                    credential=AzureKeyCredential(settings.search_key),
+                    transport=RequestsTransport(session=self._session, session_owner=False)
+                )
+                self._clients[key] = client
+            return client
+
+    def configured_indexes(self):
+        return [
+            index_name for index_name in [
+                settings.semantic_search_index,
+                settings.sohea_search_index,
+                settings.medical_code_index,
+                settings.research_search_index,
+                settings.research_search_section_index
+            ] if index_name
+        ]
+
+    def warm_up(self):
+        for index_name in self.configured_indexes():
+            self.get(index_name)
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            session, self._session = self._session, None
+        for client in clients:
+            client.close()
+        if session is not None:
+            session.close()
+
+search_client_registry = SearchClientRegistry(settings.search_pool_connections, settings.search_pool_maxsize)
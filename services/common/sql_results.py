@@ -0,0 +1,53 @@
+import re
+
+LIMIT_PATTERN = re.compile(r"\blimit\s+\d+(\s+offset\s+\d+)?\s*$", re.IGNORECASE)
+AGGREGATE_PATTERN = re.compile(r"\b(count|sum|avg|min|max)\s*\(", re.IGNORECASE)
+GROUP_BY_PATTERN = re.compile(r"\bgroup\s+by\b", re.IGNORECASE)
+
+def inject_limit(sql_query, max_rows):
+    """
+    Appends LIMIT max_rows + 1 to row-returning SELECTs so the warehouse stops early,
+    the extra row tells the caller the result was truncated. Aggregates without GROUP BY return one row and are left as is.
+    """
+    query = str(sql_query).strip().rstrip(";").strip()
+    if not query.lower().startswith(("select", "with")):
+        return query
+    if LIMIT_PATTERN.search(query):
+        return query
+    if AGGREGATE_PATTERN.search(query) and not GROUP_BY_PATTERN.search(query):
+        return query
+    return f"{query}\nLIMIT {max_rows + 1}"
+
+def fetch_limited(cursor, max_rows, max_bytes, fetch_size):
+    """
+    Reads rows with fetchmany until max_rows or max_bytes (estimated from the row text) is reached.
+    Returns (rows, truncated).
+    """
+    rows = []
+    used_bytes = 0
+    while True:
+        batch = cursor.fetchmany(fetch_size)
+        if not batch:
+            return rows, False
+        for row in batch:
+            values = list(row)
+            row_bytes = len(str(values))
+            if len(rows) >= max_rows or (rows and used_bytes + row_bytes > max_bytes):
+                return rows, True
+            rows.append(values)
+            used_bytes += row_bytes
+
+def summarize_result(columns, rows, truncated):
+    """Compact columnar result handed to the agent instead of the raw row list."""
+    summary = {
+        "columns": columns,
+        "row_count": len(rows),
+        "rows": rows,
+        "truncated": truncated,
+    }
+    if truncated:
+        summary["note"] = (
+            f"Result truncated to the first {len(rows)} rows. "
+            "Aggregate or filter in SQL instead of reading raw rows."
+        )
+    return summary
@@ -0,0 +1,65 @@
+from opentelemetry import trace
+from contextlib import contextmanager
+from config import settings
+import logging
+
+# Application logger
+logger = logging.getLogger("AI DataExplorer")
+
+tracer = trace.get_tracer("ai-data-explorer")
+
+def configure_tracing(exporter=None):
+    """
+    Installs an SDK tracer provider exporting to the console or an OTLP collector (TRACING_EXPORTER).
+    With "none" spans stay no-op unless another provider was installed.
+    """
+    exporter = (exporter or settings.tracing_exporter).lower()
+    if exporter == "none":
+        return None
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor, ConsoleSpanExporter
+    provider = TracerProvider(resource=Resource.create({"service.name": settings.tracing_service_name}))
+    if exporter == "console":
+        provider.add_span_processor(SimpleSpanProcessor(ConsoleSpanExporter()))
+    elif exporter == "otlp":
+        # Optional dependency, only needed when exporting to a collector
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=settings.tracing_otlp_endpoint)))
+    else:
+        logger.error("Unknown TRACING_EXPORTER %s, tracing disabled", exporter)
+        return None
+    trace.set_tracer_provider(provider)
+    return provider
+
+def _attributes(attributes):
+    # Span attributes must be primitives, None values are dropped
+    return {
+        key: value if isinstance(value, (str, bool, int, float)) else str(value)
+        for key, value in attributes.items() if value is not None
+    }
+
+@contextmanager
+def stage_span(name, parent=None, **attributes):
+    """
+    Span for a pipeline stage, current for the duration of the block so nested tool calls attach to it.
+    parent is an explicit context for stages running on worker threads or across generator yields.
+    """
+    with tracer.start_as_current_span(name, context=parent, attributes=_attributes(attributes)) as span:
+        yield span
+
+def start_span(name, parent=None, **attributes):
+    """Span that is not made current, for blocks that yield to the client; the caller ends it."""
+    return tracer.start_span(name, context=parent, attributes=_attributes(attributes))
+
+def set_span_attributes(span=None, **attributes):
+    (span or trace.get_current_span()).set_attributes(_attributes(attributes))
+
+def record_token_usage(span, callback):
+    set_span_attributes(
+        span,
+        **{"llm.input_tokens": callback.prompt_tokens, "llm.output_tokens": callback.completion_tokens}
+    )
+
+def context_with_span(span):
+    return trace.set_span_in_context(span)
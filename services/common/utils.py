@@ -1,13 +1,34 @@
 from azure.cosmos import CosmosClient
 from azure.cosmos.exceptions import CosmosHttpResponseError, CosmosResourceExistsError
 from config import settings
+from services.common.metrics import record_cosmos_request
+from contextlib import contextmanager
+import threading
 import logging
+import time
 
-# Application logger
+# Application logger, handlers and level are configured by app_logger.setup_logging
 logger = logging.getLogger("AI DataExplorer")
-logger.setLevel(logging.DEBUG)
 
 # Cosmosdb Client
+class RequestCharge:
+    """
+    Cosmos response_hook summing x-ms-request-charge over the responses of one call (every page of a query).
+    Headers come from each response, not from the connection shared with concurrent requests.
+    """
+    def __init__(self):
+        self.total = 0.0
+        self.responses = 0
+
+    def __call__(self, headers, result=None):
+        # query_items also reports the shared connection headers once with the unread pager, skip that call
+        if not (result is None or isinstance(result, (dict, list))):
+            return
+        request_charge = (headers or {}).get("x-ms-request-charge")
+        if request_charge:
+            self.total += float(request_charge)
+            self.responses += 1
+
 class azureCosmosDb:
     def __init__(self, containerName):
         self.cosmoUrl = settings.storage_dburl
@@ -15,14 +36,53 @@ class azureCosmosDb:
         self.databaseName = settings.storage_dbname
         self.containerName = containerName
         
-        self.client = CosmosClient(self.cosmoUrl, credential=self.cosmoKey)
-        self.database = self.client.get_database_client(self.databaseName)
-        self.container = self.database.get_container_client(self.containerName)
+        # The Cosmos client is connected on first use (CosmosClient reads the account on construction)
+        self._container = None
+        self._connect_lock = threading.Lock()
+        # Callbacks invoked with the written payload after every successful write
+        self.write_listeners = []
+
+    def connect(self):
+        if self._container is None:
+            with self._connect_lock:
+                if self._container is None:
+                    self.client = CosmosClient(self.cosmoUrl, credential=self.cosmoKey)
+                    self.database = self.client.get_database_client(self.databaseName)
+                    self._container = self.database.get_container_client(self.containerName)
+        return self._container
+
+    @property
+    def container(self):
+        return self.connect()
+
+    def notifyWrite(self, payload):
+        for listener in self.write_listeners:
+            try:
+                listener(payload)
+            except Exception as e:
+                logger.error("Write listener failed for %s: %s", self.containerName, str(e))
+
+    @contextmanager
+    def trackRequest(self, operation):
+        # Records latency and request units of a Cosmos call, the yielded charge is passed as the call's response_hook
+        charge = RequestCharge()
+        start_time = time.perf_counter()
+        try:
+            yield charge
+        finally:
+            record_cosmos_request(
+                self.containerName,
+                operation,
+                time.perf_counter() - start_time,
+                charge.total if charge.responses else None
+            )
 
     def insertRecord(self, payload):
         # Method to insert a record
         try:
-            resp = self.container.create_item(payload)
+            with self.trackRequest("insert") as charge:
+                resp = self.container.create_item(payload, response_hook=charge)
+            self.notifyWrite(payload)
             return {
                 "status": f"Record inserted successfully to {self.containerName}",
                 "response": resp
@@ -40,21 +100,33 @@ class azureCosmosDb:
 
     def upsertRecord(self, payload):
         # Method to upsert a record
-        logger.info("Payload: %s", payload)
-        resp = self.container.upsert_item(payload)
+        logger.info("Payload: %s", payload, extra={"payload": True})
+        with self.trackRequest("upsert") as charge:
+            resp = self.container.upsert_item(payload, response_hook=charge)
+        self.notifyWrite(payload)
         return {"status": f"Record inserted successfully to {self.containerName}", "response": resp}
 
     def updateRecord(self, itemid, payload):
         # Method to update a record
-        resp = self.container.replace_item(item=itemid, body=payload)
+        with self.trackRequest("replace") as charge:
+            resp = self.container.replace_item(item=itemid, body=payload, response_hook=charge)
+        self.notifyWrite(payload)
         return {"status": f"Record updated successfully to {self.containerName}", "response": resp}
 
-    def fetchRecord(self, query, partition_key=False):
+    def patchRecord(self, itemid, partition_key, operations):
+        # Method to partially update a record with Cosmos patch operations
+        with self.trackRequest("patch") as charge:
+            resp = self.container.patch_item(item=itemid, partition_key=partition_key, patch_operations=operations, response_hook=charge)
+        self.notifyWrite(resp)
+        return {"status": f"Record patched successfully in {self.containerName}", "response": resp}
+
+    def fetchRecord(self, query, partition_key=False, parameters=None):
         # Method to fetch record
-        if not partition_key:
-            messages = list(self.container.query_items(query=query, enable_cross_partition_query=True))
-        else:
-            messages = list(self.container.query_items(query=query, partition_key=partition_key))
+        with self.trackRequest("query") as charge:
+            if not partition_key:
+                messages = list(self.container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True, response_hook=charge))
+            else:
+                messages = list(self.container.query_items(query=query, parameters=parameters, partition_key=partition_key, response_hook=charge))
         return {"status": f"Record details fetched successfully from {self.containerName}", "response": messages}
 
 # Initializing messages ...
@@ -63,6 +135,34 @@ message_client = azureCosmosDb('messages')
 # Initializing chatSessions
 session_client = azureCosmosDb('chatSessions')
 
+# Short-lived per-user cache of the sessions sidebar listing
+class UserSessionCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, userId, key):
+        with self._lock:
+            entry = self._entries.get(userId, {}).get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                return None
+            return entry[1]
+
+    def put(self, userId, key, sessions):
+        with self._lock:
+            self._entries.setdefault(userId, {})[key] = (time.monotonic(), sessions)
+
+    def invalidate(self, userId=None):
+        with self._lock:
+            if userId is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(userId, None)
+
+session_list_cache = UserSessionCache(settings.session_list_cache_ttl)
+session_client.write_listeners.append(lambda payload: session_list_cache.invalidate(payload.get('userId')))
+
 ahrf_county_user_prompts = [
     "Which counties have the highest number of dentists per 100,000 population?",
     "How many dentists per 100,000 population are there in Los Angeles County?",
@@ -226,4 +326,11 @@ source_specific_user_prompts = {
     "hpsa": hpsa_user_prompts,
     "sohea": sohea_user_prompts,
     "dqddma": dqddma_user_prompts
-}
\ No newline at end of file
+}
+
+def sample_user_prompts():
+    # Every self-contained sample question across datasources
+    return (
+        ahrf_state_user_prompts + ahrf_county_user_prompts + merative_user_prompts + hpsa_user_prompts
+        + sohea_user_prompts + research_user_prompts + dqddma_user_prompts
+    )
@@ -0,0 +1,57 @@
+"""
+Startup profile: imports a module under `python -X importtime` and reports the slowest imports
+
+    python startup_profile.py [module] [--top N]
+"""
+
+from collections import namedtuple
+import subprocess
+import argparse
+import sys
+import re
+
+IMPORT_TIME_PATTERN = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S.*)$")
+
+ImportTiming = namedtuple("ImportTiming", ["module", "self_us", "cumulative_us", "depth"])
+
+def profile_imports(module):
+    """Imports module in a fresh interpreter and returns its ImportTiming rows and return code."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True
+    )
+    timings = []
+    for line in completed.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            timings.append(ImportTiming(name.strip(), int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return timings, completed
+
+def report(module, timings, top):
+    # Top level imports (depth 0) add up to the total import time of the module
+    total_us = sum(timing.cumulative_us for timing in timings if timing.depth == 0)
+    print(f"Import profile for {module}: {len(timings)} modules, {total_us / 1e6:.3f}s total\n")
+    print(f"{'cumulative (ms)':>16} {'self (ms)':>10}  module")
+    for timing in sorted(timings, key=lambda timing: timing.cumulative_us, reverse=True)[:top]:
+        print(f"{timing.cumulative_us / 1e3:>16.1f} {timing.self_us / 1e3:>10.1f}  {timing.module}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the slowest imports of an application module")
+    parser.add_argument("module", nargs="?", default="api.routes.endpoints", help="Module to import (default api.routes.endpoints)")
+    parser.add_argument("--top", type=int, default=25, help="Number of imports to list")
+    args = parser.parse_args()
+
+    timings, completed = profile_imports(args.module)
+    if not timings:
+        print(completed.stderr, file=sys.stderr)
+        return completed.returncode or 1
+    report(args.module, timings, args.top)
+    if completed.returncode != 0:
+        # The profile still covers everything imported before the failure
+        print(f"\nImport of {args.module} failed:\n{completed.stderr.splitlines()[-1]}", file=sys.stderr)
+    return completed.returncode
+
+if __name__ == "__main__":
+    sys.exit(main())
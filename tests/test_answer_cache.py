@@ -0,0 +1,36 @@
+from services.common.answer_cache import SemanticAnswerCache, query_literals
+import numpy as np
+
+STORED = "How many dental HPSAs were there in California in 2022?"
+
+def cache_with(query, vector):
+    cache = SemanticAnswerCache(similarity_threshold=0.9, ttl=3600, max_entries=10)
+    cache.store("HRSA", vector, query, "answer", {"sqlCode": "SELECT 1"})
+    return cache
+
+def test_punctuation_and_paraphrase_hit():
+    vector = np.array([1.0, 0.0, 0.0])
+    cache = cache_with(STORED, vector)
+    assert cache.lookup("hrsa", vector, STORED.rstrip("?")) is not None
+    assert cache.lookup("hrsa", np.array([0.99, 0.05, 0.0]), "Number of dental HPSAs in California for 2022") is not None
+    assert cache.stats()["literal_mismatches"] == 0
+
+def test_different_literals_miss():
+    vector = np.array([1.0, 0.0, 0.0])
+    cache = cache_with(STORED, vector)
+    assert cache.lookup("hrsa", vector, "How many dental HPSAs were there in California in 2021?") is None
+    assert cache.lookup("hrsa", vector, "How many dental HPSAs were there in Texas in 2022?") is None
+    assert cache.lookup("hrsa", vector, "Top 5 dental HPSAs in California in 2022?") is None
+    assert cache.stats()["literal_mismatches"] == 3
+
+def test_apostrophes_are_not_quoted_literals():
+    assert query_literals("children's dental visits in states' programs") == frozenset()
+    assert ("quoted", "kent") in query_literals("visits in 'Kent' county")
+
+def test_invalidate_all_rejects_answers_from_older_generation():
+    vector = np.array([1.0, 0.0, 0.0])
+    cache = SemanticAnswerCache(similarity_threshold=0.9, ttl=3600, max_entries=10)
+    version = cache.catalog_version("HRSA")
+    cache.invalidate()
+    cache.store("HRSA", vector, STORED, "answer", {"sqlCode": "SELECT 1"}, catalog_version=version)
+    assert cache.lookup("hrsa", vector, STORED) is None
@@ -0,0 +1,47 @@
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from services.common import tracing
+from services import agent_tools
+import pytest
+import json
+
+exporter = InMemorySpanExporter()
+provider = TracerProvider()
+provider.add_span_processor(SimpleSpanProcessor(exporter))
+trace.set_tracer_provider(provider)
+
+@pytest.fixture(autouse=True)
+def clear_spans():
+    exporter.clear()
+    yield
+
+def fake_search_index(index_name, reqbody, select_fields_, top_=50):
+    if reqbody.get("filenames"):
+        return [{"filename": reqbody["filenames"][0], "content": "section"}]
+    return [{"filename": f"doc-{i}", "content": "abstract"} for i in range(3)]
+
+def test_section_lookups_are_children_of_the_current_stage(monkeypatch):
+    monkeypatch.setattr(agent_tools, "search_index", fake_search_index)
+    with tracing.stage_span("Research-Explorer Agent") as stage:
+        sections = agent_tools.column_metadata_extractor.func(json.dumps({"query": "fluoride", "datasource": "research"}))
+    assert [section["filename"] for section in sections] == ["doc-0", "doc-1", "doc-2"]
+
+    spans = exporter.get_finished_spans()
+    search_spans = [span for span in spans if span.name == "Tool AI Search"]
+    # One document search on the calling thread and three section lookups on worker threads
+    assert len(search_spans) == 4
+    stage_context = stage.get_span_context()
+    for span in search_spans:
+        assert span.parent is not None
+        assert span.parent.span_id == stage_context.span_id
+        assert span.context.trace_id == stage_context.trace_id
+
+def test_stage_span_with_explicit_parent_joins_the_request_trace():
+    request_span = tracing.start_span("Chat Request")
+    with tracing.stage_span("Research-Explorer Agent", parent=tracing.context_with_span(request_span)):
+        pass
+    request_span.end()
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    assert spans["Research-Explorer Agent"].parent.span_id == spans["Chat Request"].context.span_id